@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""announcements.py
+
+The set of nearly sold out conferences behind the announcement.
+
+The set is a sorted list of [name, websafeConferenceKey] pairs, stored on
+a single NearlySoldOut entity and mirrored in memcache together with the
+announcement string built from it. Registrations patch the set when a
+conference's free seats cross the threshold, so the announcement is only
+rebuilt when the set actually changes. The hourly cron recomputes the set
+from the seat counters and repairs any drift.
+
+"""
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import NearlySoldOut
+
+NEARLY_SOLD_OUT_SEATS = 5
+MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
+MEMCACHE_NEARLY_SOLD_OUT_KEY = "NEARLY_SOLD_OUT"
+ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
+                    'are nearly sold out: %s')
+
+_SET_KEY = ndb.Key(NearlySoldOut, 'current')
+
+
+def isNearlySoldOut(seats):
+    """Whether a conference with seats free seats belongs in the set."""
+    return 0 < seats <= NEARLY_SOLD_OUT_SEATS
+
+
+def _announcement(entries):
+    if not entries:
+        return ""
+    return ANNOUNCEMENT_TPL % ', '.join(name for name, _ in entries)
+
+
+def _publish(entries):
+    """Cache the set and the announcement built from it."""
+    memcache.set_multi({MEMCACHE_NEARLY_SOLD_OUT_KEY: entries,
+                        MEMCACHE_ANNOUNCEMENTS_KEY: _announcement(entries)})
+
+
+def _getEntries():
+    entries = memcache.get(MEMCACHE_NEARLY_SOLD_OUT_KEY)
+    if entries is None:
+        stored = _SET_KEY.get()
+        entries = stored.entries if stored else []
+        memcache.add(MEMCACHE_NEARLY_SOLD_OUT_KEY, entries)
+    return entries
+
+
+@ndb.transactional()
+def _store(update):
+    """Apply update(entries) -> entries to the stored set. Returns the new
+    entries, or None when nothing changed."""
+    stored = _SET_KEY.get() or NearlySoldOut(key=_SET_KEY, entries=[])
+    entries = sorted(update(list(stored.entries)))
+    if entries == stored.entries:
+        return None
+    stored.entries = entries
+    stored.put()
+    return entries
+
+
+def seatsChanged(conf, seats):
+    """Record that conf now has seats free seats; the stored set and the
+    announcement are only touched when conf enters or leaves the set (or
+    was renamed while in it). Returns whether the set changed."""
+    wsck = conf.key.urlsafe()
+    wanted = conf.name if isNearlySoldOut(seats) else None
+    current = dict((key, name) for name, key in _getEntries())
+    if current.get(wsck) == wanted:
+        return False
+
+    def update(entries):
+        entries = [entry for entry in entries if entry[1] != wsck]
+        if wanted:
+            entries.append([wanted, wsck])
+        return entries
+
+    entries = _store(update)
+    if entries is None:
+        # the stored set was right, only the cached copy was stale
+        stored = _SET_KEY.get()
+        entries = stored.entries if stored else []
+    _publish(entries)
+    return True
+
+
+def getMembers():
+    """Return the websafe keys of the conferences currently in the set."""
+    return [wsck for _, wsck in _getEntries()]
+
+
+def reconcile(conferences):
+    """Replace the set with conferences, as found by a full recount, and
+    return the announcement."""
+    wanted = [[conf.name, conf.key.urlsafe()] for conf in conferences]
+    entries = _store(lambda entries: wanted)
+    if entries is None:
+        entries = sorted(wanted)
+    _publish(entries)
+    return _announcement(entries)
+
+
+def getAnnouncement():
+    """Return the current announcement string."""
+    announcement = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY)
+    if announcement is None:
+        announcement = _announcement(_getEntries())
+        memcache.add(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
+    return announcement
@@ -0,0 +1,496 @@
+#!/usr/bin/env python
+
+"""bench_api.py
+
+Latency, API calls and bytes per ConferenceApi endpoint, against the
+App Engine testbed stubs seeded with synthetic data.
+
+--conferences conferences get --sessions sessions each, and --profiles
+users get --registrations registrations and --wishlist wishlisted
+sessions each. Every endpoint is then called --calls times as rotating
+users, each call with a fresh ndb context as a new request would have.
+The report gives latency percentiles and, per call, the RPCs made by
+service, the bytes of RPC requests and responses, and the size of the
+JSON response. Tasks are queued but not run, so the numbers cover the
+request itself. --latency adds that many milliseconds to every RPC, as in
+bench_async.py.
+
+--stress N instead has N threads register --stress-users users for one
+conference with --stress-seats seats at the same time, then checks that
+it was not oversold.
+
+Run from the repository root with the App Engine SDK on the path:
+
+    python benchmarks/bench_api.py --conferences 50 --calls 50
+    python benchmarks/bench_api.py --stress 20 --stress-seats 100
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import datetime
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import Queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+from google.appengine.api import users
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+from protorpc import message_types
+from protorpc import protojson
+
+from bench_async import DelayedStub
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SERVICES = ('datastore_v3', 'memcache', 'taskqueue', 'search')
+CITIES = ('London', 'Paris', 'Berlin', 'Tokyo', 'Chicago')
+TOPICS = ('Web Technologies', 'Programming Languages', 'Movie Making',
+          'Health and Nutrition')
+SESSION_TYPES = ('LECTURE', 'WORKSHOP', 'NETWORKING')
+SPEAKERS = 40
+SEED_CHUNK = 100
+PERCENTILES = (50, 90, 99)
+
+
+def setUp(latency):
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1))
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=ROOT)
+    bed.init_search_stub()
+    bed.init_app_identity_stub()
+    if latency:
+        for service in SERVICES:
+            stub = apiproxy_stub_map.apiproxy.GetStub(service)
+            apiproxy_stub_map.apiproxy.ReplaceStub(service, DelayedStub(stub, latency))
+    return bed
+
+
+# imported once the stubs exist
+def _imports():
+    global conference, ConferenceApi, Conference, Profile, Registration, Session
+    global ConferenceQueryForm, ConferenceQueryForms, ConferenceSearchForm
+    global ConflictException, ListView
+    global speakers, wishlist, registrationKey, reserveSeats, getSeatsAvailable
+    global DEFAULT_SEAT_SHARDS, randomId, takeIds
+    import conference
+    from conference import ConferenceApi
+    from models import Conference, Profile, Registration, Session
+    from models import ConferenceQueryForm, ConferenceQueryForms
+    from models import ConferenceSearchForm, ConflictException, ListView
+    import speakers
+    import wishlist
+    from registrations import registrationKey
+    from seats import DEFAULT_SEAT_SHARDS, getSeatsAvailable, reserveSeats
+    from idpool import randomId, takeIds
+
+
+# - - - RPC accounting - - - - - - - - - - - - - - - - - - - -
+
+_local = threading.local()
+
+
+def _size(pb):
+    try:
+        return pb.ByteSize()
+    except Exception:
+        return 0
+
+
+def _beforeRpc(service, call, request, response):
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        stats[service] += 1
+        stats['rpcBytes'] += _size(request)
+
+
+def _afterRpc(service, call, request, response):
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        stats['rpcBytes'] += _size(response)
+
+
+def installHooks():
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('bench_api', _beforeRpc)
+    apiproxy_stub_map.apiproxy.GetPostCallHooks().Append('bench_api', _afterRpc)
+
+
+def call(method, request, email):
+    """Call a ConferenceApi method as a new request from email. Returns
+    (response, milliseconds, stats)."""
+    ndb.get_context().clear_cache()
+    api = ConferenceApi()
+    # what _getCurrentUser() would resolve from the request's token
+    api._ctx = {'requestId': os.environ.get('REQUEST_LOG_ID'),
+                'user': users.User(email)}
+    _local.stats = collections.Counter()
+    start = time.time()
+    try:
+        response = getattr(api, method)(request)
+    finally:
+        elapsed = (time.time() - start) * 1000
+        stats, _local.stats = _local.stats, None
+    return response, elapsed, stats
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return 0.0
+    return values[max(0, int(math.ceil(p / 100.0 * len(values))) - 1)]
+
+
+# - - - Seeding - - - - - - - - - - - - - - - - - - - - - - - -
+
+def email(i):
+    return 'user%d@example.com' % i
+
+
+def seedProfiles(emails):
+    ndb.put_multi([Profile(key=ndb.Key(Profile, e), displayName=e.split('@')[0],
+                           mainEmail=e, teeShirtSize='NOT_SPECIFIED')
+                   for e in emails])
+
+
+def seedConferences(n, profiles, seats):
+    confs = []
+    start = datetime.date(2016, 5, 1)
+    for i in range(n):
+        p_key = ndb.Key(Profile, email(i % profiles))
+        first = start + datetime.timedelta(days=7 * (i % 40))
+        confs.append(Conference(
+            key=ndb.Key(Conference, randomId(), parent=p_key),
+            name='Conference %d' % i, description='Conference number %d' % i,
+            organizerUserId=p_key.id(), organizerDisplayName=p_key.id(),
+            topics=[TOPICS[i % len(TOPICS)], TOPICS[(i + 1) % len(TOPICS)]],
+            city=CITIES[i % len(CITIES)], startDate=first, month=first.month,
+            endDate=first + datetime.timedelta(days=2),
+            maxAttendees=seats, seatsAvailable=seats,
+            seatShards=DEFAULT_SEAT_SHARDS))
+    for i in range(0, n, SEED_CHUNK):
+        ndb.Future.wait_all([ConferenceApi._storeConferenceAsync(conf)
+                             for conf in confs[i:i + SEED_CHUNK]])
+    return confs
+
+
+def seedSessions(confs, per_conference):
+    sessions = {}
+    for c in confs:
+        ids = takeIds(Session, c.key, per_conference)
+        sessions[c.key] = [Session(
+            key=ndb.Key(Session, session_id, parent=c.key),
+            name='Session %d' % i, highlights='Highlights of session %d' % i,
+            speaker='Speaker %d' % ((session_id + i) % SPEAKERS),
+            duration=30 + 30 * (i % 3),
+            typeOfSession=SESSION_TYPES[i % len(SESSION_TYPES)],
+            date=c.startDate + datetime.timedelta(days=i % 3),
+            startTime=datetime.time(9 + i % 8, 30 * (i % 2)))
+            for i, session_id in enumerate(ids)]
+        ndb.put_multi(sessions[c.key])
+        speakers.indexSessions(sessions[c.key])
+    return sessions
+
+
+def seedRegistrations(profiles, confs, per_profile, rand):
+    """Register every profile for per_profile random conferences; returns
+    {email: [Conference]}."""
+    attending = {}
+    per_conference = collections.Counter()
+    regs = []
+    for i in range(profiles):
+        p_key = ndb.Key(Profile, email(i))
+        attending[p_key.id()] = rand.sample(confs, min(per_profile, len(confs)))
+        for c in attending[p_key.id()]:
+            regs.append(Registration(key=registrationKey(p_key, c.key.urlsafe()),
+                                     conference=c.key))
+            per_conference[c.key] += 1
+    for i in range(0, len(regs), SEED_CHUNK):
+        ndb.put_multi(regs[i:i + SEED_CHUNK])
+    for c in confs:
+        reserveSeats(c, per_conference[c.key])
+    return attending
+
+
+def seedWishlists(attending, sessions, per_profile, rand):
+    """Wishlist per_profile sessions of each profile's conferences; returns
+    {email: set(Session key)}."""
+    wishlists = {}
+    for e, confs in attending.items():
+        candidates = [s for c in confs for s in sessions[c.key]]
+        chosen = rand.sample(candidates, min(per_profile, len(candidates)))
+        for s in chosen:
+            wishlist.addSession(ndb.Key(Profile, e), s)
+        wishlists[e] = set(s.key for s in chosen)
+    return wishlists
+
+
+# - - - Endpoint scenarios - - - - - - - - - - - - - - - - - - -
+
+def scenarios(data, rand):
+    """Return (label, method, factory) triples; factory(i) returns the
+    (request, email) of the i-th call."""
+    confs = data['confs']
+    sessions = data['sessions']
+    profiles = data['profiles']
+    attending = data['attending']
+    wishlists = data['wishlists']
+    void = message_types.VoidMessage
+
+    def user(i):
+        return email(i % profiles)
+
+    def conf(i):
+        return confs[i % len(confs)]
+
+    def container(name, **fields):
+        return getattr(conference, name).combined_message_class(**fields)
+
+    def newRegistration(i):
+        # a conference the user has not registered for yet
+        e = user(i)
+        taken = set(c.key for c in attending[e])
+        c = rand.choice([c for c in confs if c.key not in taken])
+        attending[e].append(c)
+        return container('CONF_GET_REQUEST',
+                         websafeConferenceKey=c.key.urlsafe()), e
+
+    def newWishlistEntry(i):
+        e = user(i)
+        c = rand.choice(attending[e])
+        candidates = [s for s in sessions[c.key] if s.key not in wishlists[e]]
+        s = rand.choice(candidates or sessions[c.key])
+        wishlists[e].add(s.key)
+        return container('SESS_GET_REQUEST',
+                         websafeSessionKey=s.key.urlsafe()), e
+
+    def newSession(i):
+        c = conf(i)
+        return container('SESS_POST_REQUEST',
+                         websafeConferenceKey=c.key.urlsafe(),
+                         name='New session %d' % i, speaker='Speaker %d' % i,
+                         duration=60, date=str(c.startDate),
+                         startTime='%02d:00' % (9 + i % 8)), c.organizerUserId
+
+    return [
+        ('getProfile', 'getProfile', lambda i: (void(), user(i))),
+        ('getConference', 'getConference', lambda i: (
+            container('CONF_GET_REQUEST',
+                      websafeConferenceKey=conf(i).key.urlsafe()), user(i))),
+        ('queryConferences', 'queryConferences', lambda i: (
+            ConferenceQueryForms(), user(i))),
+        ('queryConferences city', 'queryConferences', lambda i: (
+            ConferenceQueryForms(filters=[ConferenceQueryForm(
+                field='CITY', operator='EQ', value=CITIES[i % len(CITIES)])]),
+            user(i))),
+        ('queryConferences summary', 'queryConferences', lambda i: (
+            ConferenceQueryForms(view=ListView.SUMMARY), user(i))),
+        ('searchConferences', 'searchConferences', lambda i: (
+            ConferenceSearchForm(query=TOPICS[i % len(TOPICS)].split()[0]),
+            user(i))),
+        ('getConferencesCreated', 'getConferencesCreated', lambda i: (
+            container('CONF_LIST_REQUEST'), conf(i).organizerUserId)),
+        ('getConferencesToAttend', 'getConferencesToAttend', lambda i: (
+            void(), user(i))),
+        ('getConferenceSessions', 'getConferenceSessions', lambda i: (
+            container('SESS_CONFERENCE_GET_REQUEST',
+                      websafeConferenceKey=conf(i).key.urlsafe()), user(i))),
+        ('getSessionsBySpeaker', 'getSessionsBySpeaker', lambda i: (
+            container('SESS_SPEAKER_REQUEST',
+                      speaker='Speaker %d' % (i % SPEAKERS)), user(i))),
+        ('getAttendedConferenceSessions', 'getAttendedConferenceSessions',
+         lambda i: (container('SESS_LIST_REQUEST'), user(i))),
+        ('getSessionsInWishlist', 'getSessionsInWishlist', lambda i: (
+            container('WISHLIST_REQUEST'), user(i))),
+        ('getAnnouncement', 'getAnnouncement', lambda i: (void(), user(i))),
+        ('registerForConference', 'registerForConference', newRegistration),
+        ('addSessionToWishlist', 'addSessionToWishlist', newWishlistEntry),
+        ('createSession', 'createSession', newSession),
+    ]
+
+
+def runScenario(label, method, factory, calls):
+    times = []
+    totals = collections.Counter()
+    errors = collections.Counter()
+    for i in range(calls):
+        try:
+            request, e = factory(i)
+            response, elapsed, stats = call(method, request, e)
+        except Exception as err:
+            errors[type(err).__name__] += 1
+            continue
+        times.append(elapsed)
+        totals.update(stats)
+        totals['responseBytes'] += len(protojson.encode_message(response))
+    times.sort()
+    n = len(times) or 1
+    result = dict(('p%d' % p, round(percentile(times, p), 2)) for p in PERCENTILES)
+    result['max'] = round(times[-1], 2) if times else 0.0
+    result['calls'] = len(times)
+    result['errors'] = dict(errors)
+    for key in ('datastore_v3', 'memcache', 'taskqueue', 'search'):
+        result[key] = round(totals[key] / float(n), 2)
+    result['rpcs'] = round(sum(totals[key] for key in totals
+                               if key not in ('rpcBytes', 'responseBytes'))
+                           / float(n), 2)
+    result['rpcBytes'] = int(totals['rpcBytes'] / n)
+    result['responseBytes'] = int(totals['responseBytes'] / n)
+    return result
+
+
+def report(results):
+    print('%-30s %8s %8s %8s %8s %6s %6s %6s %6s %8s %8s' % (
+        'endpoint', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'rpcs',
+        'ds', 'mc', 'tq', 'rpc B', 'resp B'))
+    for label, r in results:
+        print('%-30s %8.1f %8.1f %8.1f %8.1f %6.1f %6.1f %6.1f %6.1f %8d %8d' % (
+            label, r['p50'], r['p90'], r['p99'], r['max'], r['rpcs'],
+            r['datastore_v3'], r['memcache'], r['taskqueue'],
+            r['rpcBytes'], r['responseBytes']))
+        if r['errors']:
+            print('%-30s errors: %s' % ('', ', '.join(
+                '%s x%d' % item for item in sorted(r['errors'].items()))))
+
+
+# - - - Stress - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def stress(threads, seats, user_count):
+    """Register user_count users for one conference with seats seats from
+    threads threads at once."""
+    emails = ['stress%d@example.com' % i for i in range(user_count)]
+    seedProfiles(emails + ['organizer@example.com'])
+    p_key = ndb.Key(Profile, 'organizer@example.com')
+    conf = Conference(
+        key=ndb.Key(Conference, randomId(), parent=p_key),
+        name='Stress', organizerUserId=p_key.id(), city='London',
+        maxAttendees=seats, seatsAvailable=seats, seatShards=DEFAULT_SEAT_SHARDS)
+    ConferenceApi._storeConferenceAsync(conf).get_result()
+    request = conference.CONF_GET_REQUEST.combined_message_class(
+        websafeConferenceKey=conf.key.urlsafe())
+
+    pending = Queue.Queue()
+    for e in emails:
+        pending.put(e)
+    times = []
+    outcomes = collections.Counter()
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            try:
+                e = pending.get_nowait()
+            except Queue.Empty:
+                return
+            start = time.time()
+            try:
+                call('registerForConference', request, e)
+                outcome = 'registered'
+            except ConflictException:
+                outcome = 'sold out'
+            except Exception as err:
+                outcome = type(err).__name__
+            with lock:
+                times.append((time.time() - start) * 1000)
+                outcomes[outcome] += 1
+
+    start = time.time()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.time() - start
+
+    times.sort()
+    registrations = Registration.query(
+        Registration.conference == conf.key).count(keys_only=True)
+    memcache.flush_all()
+    free = getSeatsAvailable(conf)
+    print('%d registrations from %d threads in %.2f s (%.1f/s)' % (
+        user_count, threads, elapsed, user_count / elapsed))
+    print('latency ms: %s, max %.1f' % (', '.join(
+        'p%d %.1f' % (p, percentile(times, p)) for p in PERCENTILES), times[-1]))
+    print('outcomes: %s' % ', '.join(
+        '%s %d' % item for item in sorted(outcomes.items())))
+    ok = registrations == outcomes['registered'] and registrations + free == seats
+    print('seats %d, registrations %d, free %d: %s' % (
+        seats, registrations, free, 'consistent' if ok else 'INCONSISTENT'))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--conferences', type=int, default=50)
+    parser.add_argument('--sessions', type=int, default=10,
+                        help='sessions per conference')
+    parser.add_argument('--profiles', type=int, default=100)
+    parser.add_argument('--registrations', type=int, default=5,
+                        help='registrations per profile')
+    parser.add_argument('--wishlist', type=int, default=5,
+                        help='wishlisted sessions per profile')
+    parser.add_argument('--calls', type=int, default=50,
+                        help='calls per endpoint')
+    parser.add_argument('--only', help='comma separated endpoint labels to run')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='milliseconds added to every RPC')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--stress', type=int, default=0, metavar='THREADS',
+                        help='run the concurrent registration stress test')
+    parser.add_argument('--stress-seats', type=int, default=100)
+    parser.add_argument('--stress-users', type=int, default=200)
+    args = parser.parse_args()
+
+    bed = setUp(args.latency / 1000.0)
+    try:
+        _imports()
+        installHooks()
+        if args.stress:
+            sys.exit(0 if stress(args.stress, args.stress_seats,
+                                 args.stress_users) else 1)
+
+        rand = random.Random(args.seed)
+        start = time.time()
+        seedProfiles([email(i) for i in range(args.profiles)])
+        # room for every seeded and benchmarked registration
+        confs = seedConferences(args.conferences, args.profiles,
+                                args.profiles + args.calls)
+        sessions = seedSessions(confs, args.sessions)
+        attending = seedRegistrations(args.profiles, confs,
+                                      args.registrations, rand)
+        wishlists = seedWishlists(attending, sessions, args.wishlist, rand)
+        print('seeded %d conferences, %d sessions, %d profiles in %.1f s' % (
+            len(confs), len(confs) * args.sessions, args.profiles,
+            time.time() - start))
+
+        data = dict(confs=confs, sessions=sessions, profiles=args.profiles,
+                    attending=attending, wishlists=wishlists)
+        only = set(args.only.split(',')) if args.only else None
+        results = [(label, runScenario(label, method, factory, args.calls))
+                   for label, method, factory in scenarios(data, rand)
+                   if not only or label in only]
+        report(results)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(collections.OrderedDict(results), f, indent=2)
+    finally:
+        bed.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+"""bench_async.py
+
+Latency of the createSession and createConference write paths: the old
+sequential RPCs against the tasklets in ConferenceApi.
+
+The local service stubs answer instantly and only run a call when it is
+waited on, which hides any overlap. Every stub is therefore wrapped so
+that each call runs on its own thread after --latency milliseconds, the
+way concurrent RPCs overlap against the production services.
+
+Run from the repository root with the App Engine SDK on the path:
+
+    python benchmarks/bench_async.py --latency 20 --runs 20
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from google.appengine.api import apiproxy_rpc
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SERVICES = ('datastore_v3', 'memcache', 'taskqueue')
+
+
+class _Joined(object):
+    """Stands in for the stub once the call runs on a thread: waiting on
+    the RPC joins the thread."""
+    def __init__(self, rpc):
+        self.rpc = rpc
+
+    def MakeSyncCall(self, service, call, request, response):
+        self.rpc.thread.join()
+        if self.rpc.error:
+            raise self.rpc.error[0], self.rpc.error[1], self.rpc.error[2]
+
+
+class _DelayedRPC(apiproxy_rpc.RPC):
+    def __init__(self, latency, **kwargs):
+        super(_DelayedRPC, self).__init__(**kwargs)
+        self.latency = latency
+        self.thread = None
+        self.error = None
+
+    def _run(self, stub):
+        time.sleep(self.latency)
+        try:
+            stub.MakeSyncCall(self.package, self.call, self.request, self.response)
+        except Exception:
+            self.error = sys.exc_info()
+
+    def _MakeCallImpl(self):
+        super(_DelayedRPC, self)._MakeCallImpl()
+        self.thread = threading.Thread(target=self._run, args=(self.stub,))
+        self.thread.start()
+        self.stub = _Joined(self)
+
+
+class DelayedStub(object):
+    """Wraps a service stub, adding latency to every call."""
+    def __init__(self, stub, latency):
+        self.stub = stub
+        self.latency = latency
+
+    def CreateRPC(self):
+        return _DelayedRPC(self.latency, stub=self.stub)
+
+    def MakeSyncCall(self, service, call, request, response):
+        time.sleep(self.latency)
+        self.stub.MakeSyncCall(service, call, request, response)
+
+    def __getattr__(self, name):
+        return getattr(self.stub, name)
+
+
+def setUp(latency):
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.init_datastore_v3_stub()
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=ROOT)
+    bed.init_search_stub()
+    bed.init_app_identity_stub()
+    for service in SERVICES:
+        stub = apiproxy_stub_map.apiproxy.GetStub(service)
+        apiproxy_stub_map.apiproxy.ReplaceStub(service, DelayedStub(stub, latency))
+    return bed
+
+
+# imported once the stubs exist
+def _imports():
+    global ConferenceApi, Conference, Profile, Session
+    global speakers, seats, MEMCACHE_SCHEDULE_KEY, randomId
+    from conference import ConferenceApi
+    from idpool import randomId
+    from models import Conference, Profile, Session
+    import seats
+    import speakers
+    from schedule import MEMCACHE_SCHEDULE_KEY
+
+
+def sessionData(i):
+    return dict(name='Session %d' % i, speaker='Speaker %d' % (i % 7),
+                duration=60, typeOfSession='LECTURE',
+                date=datetime.date(2016, 5, 1),
+                startTime=datetime.time(9 + i % 8, 0))
+
+
+def createSessionSequential(conference_key, i):
+    """createSession before the tasklets: one RPC after the other."""
+    session_id = Session.allocate_ids(size=1, parent=conference_key)[0]
+    session = Session(key=ndb.Key(Session, session_id, parent=conference_key),
+                      **sessionData(i))
+    session.put()
+    wsck = conference_key.urlsafe()
+    memcache.delete(MEMCACHE_SCHEDULE_KEY % wsck)
+    taskqueue.add(params={'websafeConferenceKey': wsck},
+                  url='/tasks/rebuild_schedule')
+    speakers._addToSpeakerAsync(speakers.speakerKey(session.speaker),
+                                session.speaker, [session.key]).get_result()
+    taskqueue.add(params={'speaker': session.speaker, 'conference_key': wsck},
+                  url='/tasks/set_featured_speaker')
+
+
+def createSessionAsync(conference_key, i):
+    ConferenceApi._storeSessionAsync(conference_key, sessionData(i)).get_result()
+
+
+def conferenceData(i):
+    return dict(name='Conference %d' % i, city='London', topics=['Web'],
+                maxAttendees=100, seatsAvailable=100, seatShards=5,
+                organizerUserId='bench@example.com')
+
+
+def createConferenceSequential(p_key, i):
+    """createConference before the tasklets: one RPC after the other."""
+    c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
+    p_key.get()
+    conf = Conference(key=ndb.Key(Conference, c_id, parent=p_key),
+                      **conferenceData(i))
+    conf.put()
+    seats.createShards(conf)
+    taskqueue.add(params={'websafeConferenceKey': conf.key.urlsafe()},
+                  url='/tasks/index_conference')
+
+
+def createConferenceAsync(p_key, i):
+    p_key.get()
+    conf = Conference(key=ndb.Key(Conference, randomId(), parent=p_key),
+                      **conferenceData(i))
+    ConferenceApi._storeConferenceAsync(conf).get_result()
+
+
+def bench(label, func, arg, runs):
+    times = []
+    for i in range(runs):
+        ndb.get_context().clear_cache()
+        start = time.time()
+        func(arg, i)
+        times.append((time.time() - start) * 1000)
+    times.sort()
+    median = times[len(times) // 2]
+    print('%-30s median %7.1f ms   p90 %7.1f ms' % (
+        label, median, times[min(len(times) - 1, int(len(times) * 0.9))]))
+    return median
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--latency', type=float, default=20,
+                        help='milliseconds added to every RPC')
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    bed = setUp(args.latency / 1000.0)
+    try:
+        _imports()
+        p_key = ndb.Key(Profile, 'bench@example.com')
+        Profile(key=p_key, displayName='Bench').put()
+        conf = Conference(key=ndb.Key(Conference, 1, parent=p_key),
+                          **conferenceData(0))
+        conf.put()
+
+        old = bench('createSession, sequential', createSessionSequential,
+                    conf.key, args.runs)
+        new = bench('createSession, tasklets', createSessionAsync,
+                    conf.key, args.runs)
+        print('%-30s %7.1fx' % ('speedup', old / new))
+        old = bench('createConference, sequential', createConferenceSequential,
+                    p_key, args.runs)
+        new = bench('createConference, tasklets', createConferenceAsync,
+                    p_key, args.runs)
+        print('%-30s %7.1fx' % ('speedup', old / new))
+    finally:
+        bed.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+"""bench_serialization.py
+
+Per-row cost of copying Conference and Session entities onto their forms:
+the old all_fields()/hasattr/setattr loop against the precompiled
+converters.
+
+Run from the repository root with the App Engine SDK on the path:
+
+    python benchmarks/bench_serialization.py --rows 1000 --repeat 5
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('APPLICATION_ID', 'dev~bench')
+
+from google.appengine.ext import ndb
+
+from converters import CONFERENCE_CONVERTER
+from converters import SESSION_CONVERTER
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+from models import Session
+from models import SessionForm
+from models import SessionType
+
+
+def legacyConferenceToForm(conf, displayName):
+    cf = ConferenceForm()
+    for field in cf.all_fields():
+        if hasattr(conf, field.name):
+            if field.name.endswith('Date'):
+                setattr(cf, field.name, str(getattr(conf, field.name)))
+            else:
+                setattr(cf, field.name, getattr(conf, field.name))
+        elif field.name == "websafeKey":
+            setattr(cf, field.name, conf.key.urlsafe())
+    if displayName:
+        setattr(cf, 'organizerDisplayName', displayName)
+    cf.check_initialized()
+    return cf
+
+
+def legacySessionToForm(session):
+    sf = SessionForm()
+    for field in sf.all_fields():
+        if hasattr(session, field.name):
+            if field.name in ('date', 'startTime'):
+                setattr(sf, field.name, str(getattr(session, field.name)))
+            elif field.name == 'typeOfSession':
+                setattr(sf, field.name,
+                        getattr(SessionType, getattr(session, field.name)))
+            else:
+                setattr(sf, field.name, getattr(session, field.name))
+        elif field.name == 'websafeSessionKey':
+            setattr(sf, field.name, session.key.urlsafe())
+    sf.check_initialized()
+    return sf
+
+
+def makeEntities(rows):
+    p_key = ndb.Key(Profile, 'bench@example.com')
+    start = datetime.date(2016, 5, 1)
+    conferences = []
+    sessions = []
+    for i in range(rows):
+        c_key = ndb.Key(Conference, i + 1, parent=p_key)
+        conferences.append(Conference(
+            key=c_key, name='Conference %d' % i, description='x' * 200,
+            organizerUserId=p_key.id(), organizerDisplayName='Bench',
+            topics=['Web Technologies', 'Programming Languages'],
+            city='London', startDate=start,
+            endDate=start + datetime.timedelta(days=2), month=5,
+            maxAttendees=500, seatsAvailable=250))
+        sessions.append(Session(
+            key=ndb.Key(Session, i + 1, parent=c_key), name='Session %d' % i,
+            highlights='x' * 100, speaker='Speaker %d' % (i % 50),
+            duration=60, typeOfSession='LECTURE', date=start,
+            startTime=datetime.time(9 + i % 8, 0)))
+    return conferences, sessions
+
+
+def bench(label, func, entities, repeat):
+    best = min(timeit.repeat(lambda: [func(e) for e in entities],
+                             number=1, repeat=repeat))
+    per_row = best / len(entities) * 1e6
+    print('%-28s %10.1f us/row' % (label, per_row))
+    return per_row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    conferences, sessions = makeEntities(args.rows)
+    old = bench('conference, all_fields loop',
+                lambda conf: legacyConferenceToForm(conf, 'Bench'),
+                conferences, args.repeat)
+    new = bench('conference, converter',
+                lambda conf: CONFERENCE_CONVERTER.toForm(conf, seatsAvailable=250),
+                conferences, args.repeat)
+    print('%-28s %10.1fx' % ('speedup', old / new))
+    old = bench('session, all_fields loop', legacySessionToForm,
+                sessions, args.repeat)
+    new = bench('session, converter', SESSION_CONVERTER.toForm,
+                sessions, args.repeat)
+    print('%-28s %10.1fx' % ('speedup', old / new))
+
+
+if __name__ == '__main__':
+    main()
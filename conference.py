@@ -13,6 +13,11 @@ created by wesc on 2014 apr 21
 __author__ = 'alanjgou@gmail.com (Alan Gou)'
 
 
+import base64
+import collections
+import csv
+import os
+import StringIO
 from datetime import datetime
 from datetime import date as datetime_date
 
@@ -22,42 +27,118 @@ from protorpc import message_types
 from protorpc import remote
 
 from google.appengine.api import memcache
+from google.appengine.api import search
 from google.appengine.api import taskqueue
+from google.appengine.api import datastore_errors
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
+from google.net.proto.ProtocolBuffer import ProtocolBufferDecodeError
 
 from models import ConflictException
 from models import Profile
 from models import ProfileMiniForm
 from models import ProfileForm
+from models import ProfileForms
+from models import Registration
 from models import StringMessage
 from models import BooleanMessage
+from models import BatchRegistrationForm
+from models import BatchRegistrationResultForm
+from models import BatchRegistrationResultForms
+from models import FeaturedSpeakerForm
 from models import Conference
 from models import ConferenceForm
 from models import ConferenceForms
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
+from models import ConferenceSearchForm
+from models import ConferenceSearchForms
+from models import FacetForm
+from models import FacetValueForm
 from models import TeeShirtSize
 from models import SessionForm
 from models import SessionForms
 from models import SessionMiniForm
 from models import Session
+from models import Speaker
 from models import SessionType
 from models import SessionTimeQueryForm
 from models import SessionTypeTimeForm
+from models import SessionImportForm
+from models import SessionImportResultForm
+from models import WishlistResultForm
+from models import ListView
+
+import announcements
+import conferencesearch
+import entitycache
+import mailer
+import queryplanner
+
+from converters import ATTENDEE_CONVERTER
+from converters import CONFERENCE_CONVERTER
+from converters import CONFERENCE_SUMMARY_CONVERTER
+from converters import PROFILE_CONVERTER
+from converters import SESSION_CONVERTER
+from converters import SESSION_SUMMARY_CONVERTER
+from converters import SESSION_SUMMARY_FIELDS
+from converters import sessionRowToForm
 
 from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
 from settings import IOS_CLIENT_ID
 from settings import ANDROID_AUDIENCE
 
+from schedule import getSchedule
+from schedule import getSchedules
+from schedule import scheduleChanged
+from schedule import scheduleChangedAsync
+
+from seats import DEFAULT_SEAT_SHARDS
+from seats import MAX_SEAT_SHARDS
+from seats import adjustSeats
+from seats import createShardsAsync
+from seats import getSeatsAvailable
+from seats import getSeatsAvailableMulti
+from seats import releaseSeat
+from seats import reserveSeats
+from seats import takeSeat
+
+from idpool import randomId
+from idpool import takeIdAsync
+from idpool import takeIds
+
+from instrumentation import instrumented
+
+from registrations import getAttendeeKeys
+from registrations import getConferenceKeysToAttend
+from registrations import getConferenceKeysToAttendMulti
+from registrations import migrateProfile
+from registrations import registrationKey
+
+import wishlist
+
+from speakers import getSpeaker
+from speakers import indexSessionsAsync
+
+from utils import addTaskAsync
 from utils import getUserId
 
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
-MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
 MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER"
-ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
-                    'are nearly sold out: %s')
+MEMCACHE_CONFERENCE_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER:%s"
+FEATURED_SPEAKER_TPL = 'Featured speaker: %s. Sessions: %s'
+FEATURED_SPEAKER_CAS_RETRIES = 10
+ATTENDED_SESSIONS_FANOUT = 10           # conferences queried concurrently
+ORGANIZER_UPDATE_BATCH_SIZE = 100
+MAX_BATCH_REGISTRATIONS = 500           # users x conferences per request
+MAX_SESSION_IMPORT = 1000
+SESSION_IMPORT_CHUNK = 100              # sessions per put_multi
+SESSION_IMPORT_COLUMNS = ('name', 'highlights', 'speaker', 'duration',
+                          'typeOfSession', 'date', 'startTime')
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 CONFERENCE_DEFAULTS = {
@@ -65,6 +146,7 @@ CONFERENCE_DEFAULTS = {
     "maxAttendees": 0,
     "seatsAvailable": 0,
     "topics": [ "Default", "Topic" ],
+    "seatShards": DEFAULT_SEAT_SHARDS,
 }
 
 SESSION_DEFAULTS = {
@@ -92,6 +174,20 @@ CONF_GET_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+ATTENDEES_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
+)
+
+CONF_LIST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    pageSize=messages.IntegerField(1, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(2),
+    view=messages.EnumField(ListView, 3),
+)
+
 CONF_POST_REQUEST = endpoints.ResourceContainer(
     ConferenceForm,
     websafeConferenceKey=messages.StringField(1),
@@ -99,31 +195,63 @@ CONF_POST_REQUEST = endpoints.ResourceContainer(
 
 SESS_CONFERENCE_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
-    websafeConferenceKey=messages.StringField(1)
+    websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
+    view=messages.EnumField(ListView, 4),
+)
+
+SESS_LIST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    pageSize=messages.IntegerField(1, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(2),
+    view=messages.EnumField(ListView, 3),
 )
 
 SESS_GET_REQUEST = endpoints.ResourceContainer(
     websafeSessionKey=messages.StringField(1)
 )
 
+WISHLIST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
+    view=messages.EnumField(ListView, 4),
+)
+
 SESS_POST_REQUEST = endpoints.ResourceContainer(
     SessionForm,
     websafeConferenceKey=messages.StringField(1)
 )
 
+SESSION_IMPORT_REQUEST = endpoints.ResourceContainer(
+    SessionImportForm,
+    websafeConferenceKey=messages.StringField(1),
+)
+
 SESS_TYPE_REQUEST = endpoints.ResourceContainer(
     SessionMiniForm,
     websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
+    view=messages.EnumField(ListView, 4),
 )
 
 SESS_SPEAKER_REQUEST = endpoints.ResourceContainer(
     speaker=messages.StringField(1),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
+    view=messages.EnumField(ListView, 4),
 )
 
 SESS_TIME_REQUEST = endpoints.ResourceContainer(
     SessionTimeQueryForm,
     websafeConferenceKey=messages.StringField(1),
     conferenceDate=messages.StringField(2),
+    pageSize=messages.IntegerField(3, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(4),
+    view=messages.EnumField(ListView, 5),
 )
 
 
@@ -136,32 +264,99 @@ SESS_TIME_REQUEST = endpoints.ResourceContainer(
 class ConferenceApi(remote.Service):
     """Conference API v0.1"""
 
+# - - - Paging - - - - - - - - - - - - - - - - - - - - - - -
+
+    def _pageSize(self, request):
+        """Return the requested page size, capped at MAX_PAGE_SIZE."""
+        if not request.pageSize:
+            return DEFAULT_PAGE_SIZE
+        if request.pageSize < 0:
+            raise endpoints.BadRequestException("'pageSize' must be positive")
+        return min(request.pageSize, MAX_PAGE_SIZE)
+
+    def _decodeCursor(self, token):
+        """Turn a pageToken back into a datastore Cursor."""
+        if not token:
+            return None
+        try:
+            return Cursor(urlsafe=token)
+        except (datastore_errors.BadValueError, TypeError):
+            raise endpoints.BadRequestException("Invalid 'pageToken'")
+
+    def _fetchPage(self, query, request, keys_only=False):
+        """Return one page of query results and the next page token."""
+        try:
+            results, cursor, more = query.fetch_page(
+                self._pageSize(request), keys_only=keys_only,
+                start_cursor=self._decodeCursor(request.pageToken))
+        except datastore_errors.BadRequestError:
+            # cursor from a different query
+            raise endpoints.BadRequestException("Invalid 'pageToken'")
+        return results, (cursor.urlsafe() if more and cursor else None)
+
+    def _slicePage(self, rows, request):
+        """Return one page of an in-memory list and the next page token."""
+        try:
+            offset = int(request.pageToken or 0)
+        except ValueError:
+            raise endpoints.BadRequestException("Invalid 'pageToken'")
+        if offset < 0:
+            # a negative offset would slice from the end of the list
+            raise endpoints.BadRequestException("Invalid 'pageToken'")
+        end = offset + self._pageSize(request)
+        return rows[offset:end], (str(end) if end < len(rows) else None)
+
+    def _isSummary(self, request):
+        """Whether the request asked for the SUMMARY view."""
+        return getattr(request, 'view', None) == ListView.SUMMARY
+
+    def _fetchViewPage(self, query, request):
+        """Return one page of entities and the next page token; SUMMARY
+        pages run keys-only and read the entities through entitycache."""
+        if not self._isSummary(request):
+            return self._fetchPage(query, request)
+        keys, next_token = self._fetchPage(query, request, keys_only=True)
+        return entitycache.getMulti(keys), next_token
+
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
-    def _copyConferenceToForm(self, conf, displayName):
+    def _copyConferenceToForm(self, conf, seatsAvailable=None):
         """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
-        if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
-        return cf
+        # seats live in the sharded counter, not on the Conference entity
+        if seatsAvailable is None:
+            seatsAvailable = getSeatsAvailable(conf)
+        return CONFERENCE_CONVERTER.toForm(conf, seatsAvailable=seatsAvailable)
+
+    def _copyConferencesToForms(self, conferences, summary=False):
+        """Copy Conferences to ConferenceForms with batched lookups of
+        legacy organizer names and seat counts; summary forms need
+        neither."""
+        conferences = [conf for conf in conferences if conf]
+        if summary:
+            return CONFERENCE_SUMMARY_CONVERTER.toForms(conferences)
+        self._fillOrganizerDisplayNames(conferences)
+        seats = getSeatsAvailableMulti(conferences)
+        toForm = CONFERENCE_CONVERTER.toForm
+        return [toForm(conf, seatsAvailable=seats[conf.key.urlsafe()])
+                for conf in conferences]
+
+    def _fillOrganizerDisplayNames(self, conferences):
+        """Set organizerDisplayName on conferences created before it was
+        stored on the Conference, with one batched Profile lookup."""
+        legacy = [conf for conf in conferences
+                  if conf and conf.organizerDisplayName is None]
+        if not legacy:
+            return
+        profiles = entitycache.getMulti(
+            [ndb.Key(Profile, conf.organizerUserId) for conf in legacy])
+        for conf, prof in zip(legacy, profiles):
+            conf.organizerDisplayName = getattr(prof, 'displayName', None)
 
     def _createConferenceObject(self, request):
         """Create or update Conference object, returning ConferenceForm/request."""
         # preload necessary data items
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        user = self._getCurrentUser()
+        user_id = self._getCurrentUserId()
 
         if not request.name:
             raise endpoints.BadRequestException("Conference 'name' field required")
@@ -189,34 +384,61 @@ class ConferenceApi(remote.Service):
         # set seatsAvailable to be same as maxAttendees on creation
         if data["maxAttendees"] > 0:
             data["seatsAvailable"] = data["maxAttendees"]
+        if not 1 <= data["seatShards"] <= MAX_SEAT_SHARDS:
+            raise endpoints.BadRequestException(
+                "Conference 'seatShards' must be between 1 and %d" % MAX_SEAT_SHARDS)
         # generate Profile Key based on user ID and Conference
-        # ID based on Profile key get Conference key from ID
+        # ID based on Profile key get Conference key from ID; the id is
+        # generated here, organizers create too few conferences for an
+        # id pool per Profile
         p_key = ndb.Key(Profile, user_id)
-        c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
-        c_key = ndb.Key(Conference, c_id, parent=p_key)
-        data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
+        # keep the organizer's name on the Conference so listings need no
+        # Profile lookups; saveProfile() keeps it in sync
+        data['organizerDisplayName'] = request.organizerDisplayName = \
+            self._getProfileFromUser().displayName
+        c_key = ndb.Key(Conference, randomId(), parent=p_key)
+        data['key'] = c_key
 
         # create Conference, send email to organizer confirming
         # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-            'conferenceInfo': repr(request)},
-            url='/tasks/send_confirmation_email'
-        )
+        conf = self._storeConferenceAsync(Conference(**data)).get_result()
+        # confirmations are batched per organizer by the mailer
+        mailer.enqueueConfirmation(user.email(), {
+            'name': request.name, 'city': request.city,
+            'startDate': request.startDate, 'endDate': request.endDate})
         return request
 
 
-    @ndb.transactional()
+    @staticmethod
+    @ndb.tasklet
+    def _storeConferenceAsync(conf):
+        """Write a new Conference and its seat counter shards concurrently,
+        then queue its search indexing."""
+        yield conf.put_async(), createShardsAsync(conf)
+        yield conferencesearch.conferenceChangedAsync(conf.key.urlsafe())
+        raise ndb.Return(conf)
+
+
     def _updateConferenceObject(self, request):
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        user_id = self._getCurrentUserId()
 
-        # copy ConferenceForm/ProtoRPC Message into dict
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
+        conf, oldMaxAttendees = self._updateConferenceEntity(request, user_id)
+        entitycache.invalidate(conf.key)
+        conferencesearch.conferenceChanged(conf.key.urlsafe())
+
+        # keep the seat counter in step with a changed maxAttendees
+        adjustSeats(conf, (conf.maxAttendees or 0) - (oldMaxAttendees or 0))
+        announcements.seatsChanged(conf, getSeatsAvailable(conf))
 
+        self._fillOrganizerDisplayNames([conf])
+        return self._copyConferenceToForm(conf)
+
+
+    @ndb.transactional()
+    def _updateConferenceEntity(self, request, user_id):
+        """Copy the supplied fields onto the Conference, returning it and
+        its previous maxAttendees."""
         # update existing conference
         conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
         # check that conference exists
@@ -229,10 +451,20 @@ class ConferenceApi(remote.Service):
             raise endpoints.ForbiddenException(
                 'Only the owner can update the conference.')
 
+        if request.seatShards not in (None, conf.seatShards):
+            raise endpoints.BadRequestException(
+                "Conference 'seatShards' cannot be changed after creation")
+        oldMaxAttendees = conf.maxAttendees
+
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
         for field in request.all_fields():
             data = getattr(request, field.name)
+            # seats are owned by the seat counter, the organizer fields by
+            # the Profile; never take them from the client
+            if field.name in ('seatsAvailable', 'seatShards',
+                              'organizerUserId', 'organizerDisplayName'):
+                continue
             # only copy fields where we get data
             if data not in (None, []):
                 # special handling for dates (convert string to Date)
@@ -243,12 +475,12 @@ class ConferenceApi(remote.Service):
                 # write to Conference object
                 setattr(conf, field.name, data)
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        return conf, oldMaxAttendees
 
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
             http_method='POST', name='createConference')
+    @instrumented
     def createConference(self, request):
         """Create new conference."""
         return self._createConferenceObject(request)
@@ -257,6 +489,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='PUT', name='updateConference')
+    @instrumented
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
         return self._updateConferenceObject(request)
@@ -265,62 +498,48 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='GET', name='getConference')
+    @instrumented
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
         # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        conf = entitycache.get(ndb.Key(urlsafe=request.websafeConferenceKey))
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
+        self._fillOrganizerDisplayNames([conf])
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        return self._copyConferenceToForm(conf)
 
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(CONF_LIST_REQUEST, ConferenceForms,
             path='getConferencesCreated',
             http_method='POST', name='getConferencesCreated')
+    @instrumented
     def getConferencesCreated(self, request):
         """Return conferences created by user."""
         # make sure user is authed
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        user_id = self._getCurrentUserId()
 
         # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
+        confs, next_token = self._fetchViewPage(
+            Conference.query(ancestor=ndb.Key(Profile, user_id)), request)
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName')) for conf in confs]
+            items=self._copyConferencesToForms(confs, self._isSummary(request)),
+            nextPageToken=next_token
         )
 
 
     def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
-
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
-
-        for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
-            formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
-            q = q.filter(formatted_query)
-        return q
+        """Return the query plan for the submitted filters."""
+        # the planner sends what the indexes can serve to the datastore and
+        # checks the rest in memory, so any mix of inequalities is allowed
+        return queryplanner.plan(self._formatFilters(request.filters))
 
 
     def _formatFilters(self, filters):
         """Parse, check validity and format user supplied filters."""
         formatted_filters = []
-        inequality_field = None
 
         for f in filters:
             filtr = {field.name: getattr(f, field.name) for field in f.all_fields()}
@@ -331,42 +550,77 @@ class ConferenceApi(remote.Service):
             except KeyError:
                 raise endpoints.BadRequestException("Filter contains invalid field or operator.")
 
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previous filters
-                # disallow the filter if inequality was performed on a different field before
-                # track the field on which the inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException("Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
+            if filtr["field"] in ["month", "maxAttendees"]:
+                try:
+                    filtr["value"] = int(filtr["value"])
+                except (TypeError, ValueError):
+                    raise endpoints.BadRequestException(
+                        "Filter on %s needs a number." % filtr["field"])
 
             formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+        return formatted_filters
 
 
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
             path='queryConferences',
             http_method='POST',
             name='queryConferences')
+    @instrumented
     def queryConferences(self, request):
         """Query for conferences."""
-        conferences = self._getQuery(request)
-
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
-
+        query_plan = self._getQuery(request)
+        # summary pages can run keys-only unless filters are left for memory
+        keys_only = self._isSummary(request) and not query_plan.residual
+        try:
+            conferences, cursor = queryplanner.fetchPage(
+                query_plan, self._pageSize(request),
+                start_cursor=self._decodeCursor(request.pageToken),
+                keys_only=keys_only)
+        except datastore_errors.BadRequestError:
+            # cursor from a different query
+            raise endpoints.BadRequestException("Invalid 'pageToken'")
+        if keys_only:
+            conferences = entitycache.getMulti(conferences)
+
+        # organizer display names are stored on the conferences themselves
         # return individual ConferenceForm object per Conference
         return ConferenceForms(
-                items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) for conf in \
-                conferences]
+                items=self._copyConferencesToForms(conferences,
+                                                   self._isSummary(request)),
+                nextPageToken=cursor.urlsafe() if cursor else None,
+                queryPlan=queryplanner.describe(query_plan) if request.debug else None
+        )
+
+
+    @endpoints.method(ConferenceSearchForm, ConferenceSearchForms,
+            path='searchConferences',
+            http_method='POST',
+            name='searchConferences')
+    @instrumented
+    def searchConferences(self, request):
+        """Full-text search over conference names, descriptions, topics
+        and cities, ranked by relevance, with facet counts."""
+        refinements = {'city': request.city, 'topic': request.topic,
+                       'month': str(request.month) if request.month else None}
+        try:
+            keys, next_token, total, facets = conferencesearch.searchConferences(
+                request.query, self._pageSize(request),
+                page_token=request.pageToken, refinements=refinements)
+        except search.QueryError:
+            raise endpoints.BadRequestException("Invalid search 'query'")
+        except ValueError:
+            raise endpoints.BadRequestException("Invalid 'pageToken'")
+
+        # documents of conferences that are gone are skipped
+        return ConferenceSearchForms(
+            items=self._copyConferencesToForms(entitycache.getMulti(keys),
+                                               self._isSummary(request)),
+            nextPageToken=next_token,
+            totalMatches=total,
+            facets=[FacetForm(name=name,
+                              values=[FacetValueForm(label=label, count=count)
+                                      for label, count in values])
+                    for name, values in facets]
         )
 
 
@@ -374,42 +628,110 @@ class ConferenceApi(remote.Service):
 
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
-        return pf
+        return self._copyProfilesToForms([prof])[0]
+
+    def _copyProfilesToForms(self, profiles):
+        """Copy Profiles to ProfileForms, querying their registrations
+        concurrently."""
+        profiles = [prof for prof in profiles if prof]
+        p_keys = [prof.key for prof in profiles]
+        # registrations and wishlists are entities under the Profile
+        conf_keys = getConferenceKeysToAttendMulti(p_keys)
+        session_keys = wishlist.getSessionKeysMulti(p_keys)
+        return [PROFILE_CONVERTER.toForm(
+                    prof,
+                    conferenceKeysToAttend=[key.urlsafe() for key in c_keys],
+                    sessionWishlist=[key.urlsafe() for key in s_keys] or
+                                    prof.sessionWishlist)
+                for prof, c_keys, s_keys in zip(profiles, conf_keys, session_keys)]
+
+
+    def _requestContext(self):
+        """Return the memo of user, user id and Profile for this request."""
+        request_id = os.environ.get('REQUEST_LOG_ID')
+        ctx = getattr(self, '_ctx', None)
+        if ctx is None or ctx['requestId'] != request_id:
+            ctx = self._ctx = {'requestId': request_id}
+        return ctx
+
+
+    def _getCurrentUser(self):
+        """Return the authenticated user, resolved once per request."""
+        ctx = self._requestContext()
+        if 'user' not in ctx:
+            ctx['user'] = endpoints.get_current_user()
+        if not ctx['user']:
+            raise endpoints.UnauthorizedException('Authorization required')
+        return ctx['user']
+
+
+    def _getCurrentUserId(self):
+        """Return the authenticated user's id, resolved once per request."""
+        ctx = self._requestContext()
+        if 'userId' not in ctx:
+            # Profiles are keyed by email; "oauth" ids would orphan them
+            ctx['userId'] = getUserId(self._getCurrentUser())
+        return ctx['userId']
 
 
     def _getProfileFromUser(self):
         """Return user Profile from datastore, creating new one if non-existent."""
+        ctx = self._requestContext()
+        if 'profile' in ctx:
+            return ctx['profile']
+
         # make sure user is authed
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
+        user = self._getCurrentUser()
 
         # get Profile from datastore
-        user_id = getUserId(user)
-        p_key = ndb.Key(Profile, user_id)
-        profile = p_key.get()
-        # create new Profile if not there
+        p_key = ndb.Key(Profile, self._getCurrentUserId())
+        profile = entitycache.get(p_key)
+        # create new Profile if not there; get_or_insert is transactional
+        # so two first requests can't overwrite each other
         if not profile:
-            profile = Profile(
-                key = p_key,
+            profile = Profile.get_or_insert(
+                p_key.id(),
                 displayName = user.nickname(),
                 mainEmail= user.email(),
                 teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
             )
-            profile.put()
-
+        else:
+            if profile.conferenceKeysToAttend:
+                # move legacy registrations over to Registration entities
+                profile = migrateProfile(p_key)
+                entitycache.invalidate(p_key)
+            if profile.sessionWishlist:
+                # and the legacy wishlist over to WishlistEntry entities
+                profile = wishlist.migrateWishlist(profile)
+                entitycache.invalidate(p_key)
+
+        ctx['profile'] = profile
         return profile      # return Profile
 
+    @staticmethod
+    @ndb.transactional()
+    def _updateProfileEntity(p_key, save_request):
+        """Copy the supplied fields onto the Profile, returning it, its
+        previous displayName and whether anything changed."""
+        # re-read: the cached copy may be stale, and putting it back would
+        # undo a concurrent write such as a registration migration
+        prof = p_key.get()
+        oldDisplayName = prof.displayName
+        changed = False
+        for field in ('displayName', 'teeShirtSize'):
+            if hasattr(save_request, field):
+                val = getattr(save_request, field)
+                if val:
+                    setattr(prof, field, str(val))
+                    #if field == 'teeShirtSize':
+                    #    setattr(prof, field, str(val).upper())
+                    #else:
+                    #    setattr(prof, field, val)
+                    changed = True
+        if changed:
+            prof.put()
+        return prof, oldDisplayName, changed
+
     def _doProfile(self, save_request=None):
         """Get user Profile and return to user, possibly updating it first."""
         # get user Profile
@@ -417,23 +739,56 @@ class ConferenceApi(remote.Service):
 
         # if saveProfile(), process user-modifyable fields
         if save_request:
-            for field in ('displayName', 'teeShirtSize'):
-                if hasattr(save_request, field):
-                    val = getattr(save_request, field)
-                    if val:
-                        setattr(prof, field, str(val))
-                        #if field == 'teeShirtSize':
-                        #    setattr(prof, field, str(val).upper())
-                        #else:
-                        #    setattr(prof, field, val)
-                        prof.put()
+            prof, oldDisplayName, changed = self._updateProfileEntity(
+                prof.key, save_request)
+
+            if changed:
+                entitycache.invalidate(prof.key)
+                self._requestContext()['profile'] = prof
+
+                # copy a new display name onto the user's conferences
+                if prof.displayName != oldDisplayName:
+                    taskqueue.add(params={'userId': prof.key.id()},
+                        url='/tasks/update_organizer_display_name'
+                    )
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
 
 
+    @staticmethod
+    def _updateOrganizerDisplayName(user_id, cursor=None):
+        """Copy a Profile's displayName onto one batch of the conferences
+        it organizes, chaining a task for the next batch."""
+        p_key = ndb.Key(Profile, user_id)
+        prof = p_key.get()
+        if not prof:
+            return
+        confs, next_cursor, more = Conference.query(ancestor=p_key).fetch_page(
+            ORGANIZER_UPDATE_BATCH_SIZE, start_cursor=cursor)
+
+        @ndb.transactional()
+        def _update(c_key):
+            # re-read so a concurrent updateConference isn't overwritten
+            conf = c_key.get()
+            conf.organizerDisplayName = prof.displayName
+            conf.put()
+
+        changed = [conf.key for conf in confs
+                   if conf.organizerDisplayName != prof.displayName]
+        for c_key in changed:
+            _update(c_key)
+        entitycache.invalidate(*changed)
+        if more and next_cursor:
+            taskqueue.add(params={'userId': user_id,
+                                  'cursor': next_cursor.urlsafe()},
+                url='/tasks/update_organizer_display_name'
+            )
+
+
     @endpoints.method(message_types.VoidMessage, ProfileForm,
             path='profile', http_method='GET', name='getProfile')
+    @instrumented
     def getProfile(self, request):
         """Return user profile."""
         return self._doProfile()
@@ -441,6 +796,7 @@ class ConferenceApi(remote.Service):
 
     @endpoints.method(ProfileMiniForm, ProfileForm,
             path='profile', http_method='POST', name='saveProfile')
+    @instrumented
     def saveProfile(self, request):
         """Update & return user profile."""
         return self._doProfile(request)
@@ -450,91 +806,191 @@ class ConferenceApi(remote.Service):
 
     @staticmethod
     def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
+        """Recount the nearly sold out conferences and repair the
+        announcement; used by memcache cron job. Registrations keep it
+        current in between.
         """
+        # seatsAvailable on the entity trails the seat counter by a few
+        # seconds; use it and the current set to find candidates and the
+        # counter to confirm
         confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
+            Conference.seatsAvailable <= announcements.NEARLY_SOLD_OUT_SEATS,
             Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
-
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = ANNOUNCEMENT_TPL % (
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
-
-        return announcement
+        ).fetch()
+        found = set(conf.key for conf in confs)
+        confs.extend(conf for conf in entitycache.getMulti(
+            [ndb.Key(urlsafe=wsck) for wsck in announcements.getMembers()])
+            if conf and conf.key not in found)
+        seats = getSeatsAvailableMulti(confs)
+        return announcements.reconcile(
+            [conf for conf in confs
+             if announcements.isNearlySoldOut(seats[conf.key.urlsafe()])])
 
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
             path='conference/announcement/get',
             http_method='GET', name='getAnnouncement')
+    @instrumented
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
-        return StringMessage(data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "")
+        return StringMessage(data=announcements.getAnnouncement())
 
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
-    @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
-        retval = None
-        prof = self._getProfileFromUser() # get user Profile
+        p_key = self._getProfileFromUser().key # make sure Profile exists
 
         # check if conf exists given websafeConfKey
         # get conference; check that it exists
         wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
+        conf = entitycache.get(ndb.Key(urlsafe=wsck))
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
 
-        # register
-        if reg:
+        # the Registration is written in the same transaction as one seat
+        # counter shard, never the Conference entity itself
+        reg_key = registrationKey(p_key, wsck)
+
+        def register():
             # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
+            if reg_key.get():
                 raise ConflictException(
                     "You have already registered for this conference")
+            Registration(key=reg_key, conference=conf.key).put()
+            return True
+
+        def unregister():
+            # check if user already registered
+            if not reg_key.get():
+                return False
+            reg_key.delete()
+            return True
 
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
+        # register user, take away one seat
+        if reg:
+            if not takeSeat(conf, register):
                 raise ConflictException(
                     "There are no seats available.")
-
-            # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
             retval = True
 
-        # unregister
+        # unregister user, add back one seat
         else:
-            # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+            retval = releaseSeat(conf, unregister)
 
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
+        # the announcement only changes when the seat count crosses the
+        # nearly sold out threshold
+        if retval:
+            announcements.seatsChanged(conf, getSeatsAvailable(conf))
+        return BooleanMessage(data=retval)
+
+
+    def _registerGroup(self, conf, user_ids):
+        """Register user_ids, whose Profiles exist, for conf; returns a dict
+        of the users who could not be registered and why."""
+        # all seats in one transaction over the counter shards, then all
+        # Registrations in one batch; they are children of the Profiles,
+        # too many entity groups to share the seat transaction
+        if not reserveSeats(conf, len(user_ids)):
+            return dict.fromkeys(user_ids,
+                                 'Not enough seats available for the group.')
+        wsck = conf.key.urlsafe()
+        reg_keys = [registrationKey(ndb.Key(Profile, uid), wsck) for uid in user_ids]
+
+        # re-check just before writing: a concurrent registerForConference
+        # took a seat of its own, and overwriting its Registration would
+        # leak that seat
+        errors = {}
+        new = []
+        for uid, reg_key, reg in zip(user_ids, reg_keys, ndb.get_multi(reg_keys)):
+            if reg:
+                errors[uid] = 'Already registered for this conference.'
             else:
-                retval = False
+                new.append((uid, reg_key))
+        futures = ndb.put_multi_async([Registration(key=reg_key, conference=conf.key)
+                                       for _, reg_key in new])
+        ndb.Future.wait_all(futures)
+        if any(future.get_exception() for future in futures):
+            # put_multi is not atomic; only the seats of the Registrations
+            # that were not stored are given back
+            stored = ndb.get_multi([reg_key for _, reg_key in new])
+            for (uid, _), reg in zip(new, stored):
+                if not reg:
+                    errors[uid] = 'Registration failed, please retry.'
+        if errors:
+            adjustSeats(conf, len(errors))
+        announcements.seatsChanged(conf, getSeatsAvailable(conf))
+        return errors
+
+
+    @endpoints.method(BatchRegistrationForm, BatchRegistrationResultForms,
+            path='conferences/registrations',
+            http_method='POST', name='registerForConferences')
+    @instrumented
+    def registerForConferences(self, request):
+        """Register several users for several conferences at once; an
+        organizer can register anyone for their conferences."""
+        user_id = self._getProfileFromUser().key.id() # make sure Profile exists
+        user_ids = list(collections.OrderedDict.fromkeys(request.userIds)) or [user_id]
+        wscks = list(collections.OrderedDict.fromkeys(request.websafeConferenceKeys))
+        if len(user_ids) * len(wscks) > MAX_BATCH_REGISTRATIONS:
+            raise endpoints.BadRequestException(
+                'At most %d registrations per request' % MAX_BATCH_REGISTRATIONS)
 
-        # write things back to the datastore & return
-        prof.put()
-        conf.put()
-        return BooleanMessage(data=retval)
+        conf_keys = {}
+        for wsck in wscks:
+            try:
+                key = ndb.Key(urlsafe=wsck)
+            except (TypeError, ProtocolBufferDecodeError):
+                continue
+            if key.kind() == 'Conference':
+                conf_keys[wsck] = key
+        confs = dict(zip(conf_keys, entitycache.getMulti(conf_keys.values())))
+
+        # which users have Profiles and which registrations already exist,
+        # each in one batch; registrations not yet migrated off
+        # Profile.conferenceKeysToAttend count too
+        p_keys = [ndb.Key(Profile, uid) for uid in user_ids]
+        profiles = dict(zip(user_ids, ndb.get_multi(p_keys)))
+        has_profile = dict((uid, prof is not None) for uid, prof in profiles.items())
+        pairs = [(wsck, uid) for wsck in confs if confs[wsck] for uid in user_ids]
+        registered = set(pair for pair, reg in zip(pairs, ndb.get_multi(
+            [registrationKey(ndb.Key(Profile, uid), wsck) for wsck, uid in pairs]))
+            if reg or (profiles[pair[1]] and
+                       pair[0] in profiles[pair[1]].conferenceKeysToAttend))
+
+        items = []
+        for wsck in wscks:
+            conf = confs.get(wsck)
+            errors = {}
+            if not conf:
+                errors = dict.fromkeys(user_ids, 'No conference found with this key.')
+            elif conf.organizerUserId != user_id and user_ids != [user_id]:
+                errors = dict.fromkeys(user_ids,
+                    'Only the organizer can register other users.')
+            else:
+                for uid in user_ids:
+                    if not has_profile[uid]:
+                        errors[uid] = 'No profile found for this user.'
+                    elif (wsck, uid) in registered:
+                        errors[uid] = 'Already registered for this conference.'
+                group = [uid for uid in user_ids if uid not in errors]
+                if group:
+                    errors.update(self._registerGroup(conf, group))
+            items.extend(BatchRegistrationResultForm(
+                websafeConferenceKey=wsck, userId=uid,
+                registered=uid not in errors, error=errors.get(uid))
+                for uid in user_ids)
+
+        return BatchRegistrationResultForms(items=items)
 
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='conferences/attending',
             http_method='GET', name='getConferencesToAttend')
+    @instrumented
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
         return self._getConferencesToAttend(request)
@@ -543,46 +999,51 @@ class ConferenceApi(remote.Service):
     def _getConferencesToAttend(self, request, forms=True):
         """Get list of conferences that user has registered for."""
         prof = self._getProfileFromUser() # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
-
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        conf_keys = getConferenceKeysToAttend(prof.key)
 
         if forms:
+            conferences = entitycache.getMulti(conf_keys)
             # return set of ConferenceForm objects per Conference
-            return ConferenceForms(items=[self._copyConferenceToForm(conf, names[conf.organizerUserId])\
-                                          for conf in conferences])
+            return ConferenceForms(items=self._copyConferencesToForms(conferences))
         else:
             return conf_keys
 
 
-    def _copyConferenceToForm(self, conf, displayName):
-        """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
-        if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
-        return cf
+
+    @endpoints.method(ATTENDEES_REQUEST, ProfileForms,
+            path='conference/{websafeConferenceKey}/attendees',
+            http_method='GET', name='getConferenceAttendees')
+    @instrumented
+    def getConferenceAttendees(self, request):
+        """Return a page of the profiles registered for a conference
+        (organizer only), without their other registrations or wishlists."""
+        user_id = self._getCurrentUserId()
+
+        conf = entitycache.get(ndb.Key(urlsafe=request.websafeConferenceKey))
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+        if conf.organizerUserId != user_id:
+            raise endpoints.ForbiddenException(
+                'Only the owner can list the attendees.')
+
+        try:
+            p_keys, cursor, more = getAttendeeKeys(
+                conf.key, self._pageSize(request),
+                self._decodeCursor(request.pageToken))
+        except datastore_errors.BadRequestError:
+            # cursor from a different query
+            raise endpoints.BadRequestException("Invalid 'pageToken'")
+        return ProfileForms(
+            items=ATTENDEE_CONVERTER.toForms(entitycache.getMulti(p_keys)),
+            nextPageToken=cursor.urlsafe() if more and cursor else None
+        )
+
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='POST', name='registerForConference')
+    @instrumented
     def registerForConference(self, request):
         """Register user for selected conference."""
         return self._conferenceRegistration(request)
@@ -591,6 +1052,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='DELETE', name='unregisterFromConference')
+    @instrumented
     def unregisterFromConference(self, request):
         """Unregister user for selected conference."""
         return self._conferenceRegistration(request, reg=False)
@@ -599,6 +1061,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='filterPlayground',
             http_method='GET', name='filterPlayground')
+    @instrumented
     def filterPlayground(self, request):
         """Filter Playground"""
         q = Conference.query()
@@ -612,7 +1075,7 @@ class ConferenceApi(remote.Service):
         q = q.filter(Conference.month==6)
 
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") for conf in q]
+            items=self._copyConferencesToForms(q)
         )
 
 # - - - Sessions - - - - - - - - - - - - - - - - - - - -
@@ -620,96 +1083,98 @@ class ConferenceApi(remote.Service):
     @endpoints.method(SESS_CONFERENCE_GET_REQUEST, SessionForms,
         path='getConferenceSessions',
         http_method='GET', name='getConferenceSessions')
+    @instrumented
     def getConferenceSessions(self, request):
         """Return all the sessions of a conference"""
         conference_key = ndb.Key(urlsafe=request.websafeConferenceKey)
-
-        return self._getConferenceSessions(conference_key)
-
-    def _getConferenceSessions(self, conference_key, forms=True):
-        """Returns sessions either as forms or as session objects"""
         if conference_key.kind() != 'Conference':
             raise endpoints.BadRequestException(
                 'Key %s is not a valid conference key' % conference_key
             )
 
-        sessions = Session.query(ancestor=conference_key)
+        # sessions come presorted from the conference's schedule snapshot
+        rows, next_token = self._slicePage(
+            getSchedule(conference_key)['rows'], request)
 
-        if forms:
-            return SessionForms(
-                items=[self._copySessionToForm(session) for session in sessions]
-            )
-        else:
-            return sessions
+        return SessionForms(
+            items=self._rowsToSessionForms(rows, self._isSummary(request)),
+            nextPageToken=next_token
+        )
 
 
     @endpoints.method(SESS_SPEAKER_REQUEST, SessionForms,
                       path='getSessionsBySpeaker',
                       http_method='GET', name='getSessionsBySpeaker')
+    @instrumented
     def getSessionsBySpeaker(self, request):
         """Returns the session forms of all sessions with a given speaker"""
-        sessions = Session.query().filter(Session.speaker == request.speaker)
+        # one keyed get on the speaker index, then the sessions themselves
+        speaker = getSpeaker(request.speaker)
+        session_keys, next_token = self._slicePage(
+            speaker.sessionKeys if speaker else [], request)
+        sessions = entitycache.getMulti(session_keys)
 
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=self._copySessionsToForms(sessions, self._isSummary(request)),
+            nextPageToken=next_token
         )
 
     def _copySessionToForm(self, session):
         """Copy relevant fields from Session to SessionForm."""
-        session_form = SessionForm()
-        for field in session_form.all_fields():
-            if hasattr(session, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith(('date', 'Time')):
-                    setattr(session_form, field.name, str(getattr(session, field.name)))
-                elif field.name == 'typeOfSession':
-                    setattr(session_form, field.name, getattr(SessionType, getattr(session, field.name)))
-                else:
-                    setattr(session_form, field.name, getattr(session, field.name))
-            elif field.name == 'websafeSessionKey':
-                setattr(session_form, field.name, session.key.urlsafe())
-        session_form.check_initialized()
-        return session_form
+        return SESSION_CONVERTER.toForm(session)
+
+    def _copySessionsToForms(self, sessions, summary=False):
+        """Copy Sessions to SessionForms, skipping missing ones."""
+        if summary:
+            return SESSION_SUMMARY_CONVERTER.toForms(sessions)
+        return SESSION_CONVERTER.toForms(sessions)
+
+    def _rowsToSessionForms(self, rows, summary=False):
+        """Build SessionForms from schedule snapshot rows."""
+        fields = SESSION_SUMMARY_FIELDS if summary else None
+        return [sessionRowToForm(row, fields) for row in rows]
 
 
     @endpoints.method(SESS_POST_REQUEST, SessionForm,
                       path='createSession',
                       http_method='POST',name='createSession')
+    @instrumented
     def createSession(self, request):
         """Creates a Session for the Conference"""
         # make sure user is authed
         return self._createSessionObject(request)
 
-    def _createSessionObject(self, request):
-        """Create or update Session object, returning SessionForm/request."""
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
-
-        if not request.websafeConferenceKey:
+    def _conferenceKey(self, websafeConferenceKey):
+        """Return the Conference key for a websafe key, or raise BadRequest."""
+        if not websafeConferenceKey:
             raise endpoints.BadRequestException("Session 'websafeConferenceKey' field required")
 
-        conference_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        conference_key = ndb.Key(urlsafe=websafeConferenceKey)
         if conference_key.kind() != 'Conference':
             raise endpoints.BadRequestException(
-                'Given key is not a conference key: %s' % request.websafeConferenceKey)
+                'Given key is not a conference key: %s' % websafeConferenceKey)
+        return conference_key
 
-        conference = conference_key.get()
+    def _getOrganizedConference(self, websafeConferenceKey):
+        """Return the Conference, checking the current user organizes it."""
+        conference_key = self._conferenceKey(websafeConferenceKey)
+        conference = entitycache.get(conference_key)
         if not conference:
             raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
+                'No conference found with key: %s' % websafeConferenceKey)
 
-        if conference.organizerUserId != user_id:
+        if conference.organizerUserId != self._getCurrentUserId():
             raise endpoints.UnauthorizedException('Not the conference organizer')
+        return conference
 
-        # preload necessary data items
-        if not request.name:
+    def _sessionData(self, form):
+        """Validate a SessionForm and convert it to Session properties."""
+        if not form.name:
             raise endpoints.BadRequestException("Session 'name' field required")
 
         # copy SessionForm/ProtoRPC Message into dict
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
-        del data['websafeConferenceKey']
+        data = {field.name: getattr(form, field.name) for field in form.all_fields()}
+        data.pop('websafeConferenceKey', None)
         del data['websafeSessionKey']
 
         # add default values for those missing (both data model & outbound Message)
@@ -718,42 +1183,138 @@ class ConferenceApi(remote.Service):
                 data[df] = SESSION_DEFAULTS[df]
 
         # convert dates from strings to Date objects; set month based on start_date
-        if data['date']:
-            data['date'] = datetime.strptime(data['date'][:10], "%Y-%m-%d").date()
-        if data['startTime']:
-            data['startTime'] = datetime.strptime(data['startTime'], "%H:%M").time()
+        try:
+            if data['date']:
+                data['date'] = datetime.strptime(data['date'][:10], "%Y-%m-%d").date()
+            if data['startTime']:
+                data['startTime'] = datetime.strptime(data['startTime'], "%H:%M").time()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "Session 'date' must be YYYY-MM-DD and 'startTime' HH:MM")
 
         if data['typeOfSession']:
             data['typeOfSession'] = str(data['typeOfSession'])
         else:
             del data['typeOfSession']
+        return data
 
-        # generate Conference Key based on websafeKey and
-        # Session key based on Conference key
-        # Get Session key from ID
-        session_id = Session.allocate_ids(size=1, parent=conference_key)[0]
-        session_key = ndb.Key(Session, session_id, parent=conference_key)
-        data['key'] = session_key
-
-
-
-        session = Session(**data)
-        session.put()
+    def _createSessionObject(self, request):
+        """Create or update Session object, returning SessionForm/request."""
+        conference_key = self._conferenceKey(request.websafeConferenceKey)
+        # the Session id is taken while the organizer and the fields are
+        # checked
+        session_id = takeIdAsync(Session, conference_key)
+        self._getOrganizedConference(request.websafeConferenceKey)
+        data = self._sessionData(request)
+
+        session = self._storeSessionAsync(conference_key, data,
+                                          session_id).get_result()
+        return self._copySessionToForm(session)
 
+    @staticmethod
+    @ndb.tasklet
+    def _storeSessionAsync(conference_key, data, session_id=None):
+        """Write a new Session of the conference, then index its speaker
+        while the schedule is invalidated, and only then queue the
+        featured speaker task, which reads the speaker index."""
+        # generate Session key based on Conference key
+        if session_id is None:
+            session_id = takeIdAsync(Session, conference_key)
+        session_id = yield session_id
+        session = Session(key=ndb.Key(Session, session_id, parent=conference_key),
+                          **data)
+        yield session.put_async()
+
+        wsck = conference_key.urlsafe()
+        yield scheduleChangedAsync(wsck), indexSessionsAsync([session])
         # Task to set new featured speaker if necessary
-        taskqueue.add(
-            params={
-                'speaker': session.speaker,
-                'conference_key': request.websafeConferenceKey
-            },
-            url='/tasks/set_featured_speaker'
+        yield addTaskAsync('/tasks/set_featured_speaker',
+                           params={'speaker': session.speaker,
+                                   'conference_key': wsck})
+        raise ndb.Return(session)
+
+    def _sessionFormsFromCsv(self, text):
+        """Parse CSV text with a header row of SessionForm field names into
+        a list holding a SessionForm, or an error message, per row."""
+        rows = []
+        reader = csv.DictReader(StringIO.StringIO(text.encode('utf-8')))
+        for row in reader:
+            try:
+                values = dict((name.strip(), value.decode('utf-8').strip())
+                              for name, value in row.items()
+                              if name and value and value.strip())
+                unknown = set(values) - set(SESSION_IMPORT_COLUMNS)
+                if unknown:
+                    raise ValueError('unknown columns: %s' % ', '.join(sorted(unknown)))
+                if 'duration' in values:
+                    values['duration'] = int(values['duration'])
+                if 'typeOfSession' in values:
+                    values['typeOfSession'] = SessionType(values['typeOfSession'])
+                rows.append(SessionForm(**values))
+            except (ValueError, TypeError) as e:
+                rows.append(str(e))
+        return rows
+
+    @endpoints.method(SESSION_IMPORT_REQUEST, SessionImportResultForm,
+                      path='importSessions',
+                      http_method='POST', name='importSessions')
+    @instrumented
+    def importSessions(self, request):
+        """Create many Sessions for a Conference at once, from a list of
+        SessionForms or CSV text. Nothing is imported if any row is invalid."""
+        conference = self._getOrganizedConference(request.websafeConferenceKey)
+        wsck = conference.key.urlsafe()
+
+        rows = list(request.sessions)
+        if request.csv:
+            rows.extend(self._sessionFormsFromCsv(request.csv))
+        if len(rows) > MAX_SESSION_IMPORT:
+            raise endpoints.BadRequestException(
+                'At most %d sessions per import' % MAX_SESSION_IMPORT)
+
+        # validate everything before writing anything
+        sessions_data = []
+        errors = []
+        for i, row in enumerate(rows, 1):
+            if not isinstance(row, SessionForm):
+                errors.append('row %d: %s' % (i, row))
+                continue
+            try:
+                sessions_data.append(self._sessionData(row))
+            except endpoints.BadRequestException as e:
+                errors.append('row %d: %s' % (i, e.message))
+        if errors or not sessions_data:
+            return SessionImportResultForm(imported=0, errors=errors)
+
+        # at most one id allocation, then the puts in concurrent chunks
+        session_ids = takeIds(Session, conference.key, len(sessions_data))
+        sessions = [Session(key=ndb.Key(Session, session_id, parent=conference.key),
+                            **data)
+                    for session_id, data in zip(session_ids, sessions_data)]
+        futures = [ndb.put_multi_async(sessions[i:i + SESSION_IMPORT_CHUNK])
+                   for i in range(0, len(sessions), SESSION_IMPORT_CHUNK)]
+        ndb.Future.wait_all(futures)
+        for future in futures:
+            future.check_success()
+
+        # one schedule rebuild; speaker indexing and one featured speaker
+        # recomputation run in the background
+        scheduleChanged(wsck)
+        # the task finds the sessions by ancestor query; their keys would
+        # not fit in a task
+        taskqueue.add(params={'websafeConferenceKey': wsck},
+            url='/tasks/index_imported_sessions'
         )
 
-        return self._copySessionToForm(session)
+        return SessionImportResultForm(
+            imported=len(sessions),
+            websafeSessionKeys=[session.key.urlsafe() for session in sessions]
+        )
 
     @endpoints.method(SESS_TYPE_REQUEST, SessionForms,
         path='getConferenceSessionsByType',
         http_method='GET', name='getConferenceSessionsByType')
+    @instrumented
     def getConferenceSessionsByType(self, request):
         """Gets all sessions in a conference of a certain type"""
         conference_key = ndb.Key(urlsafe=request.websafeConferenceKey)
@@ -761,80 +1322,94 @@ class ConferenceApi(remote.Service):
             raise endpoints.BadRequestException(
                 'Websafekey %s is not a valid conference key' % request.websafeConferenceKey)
 
-        sessions = Session.query(ancestor=conference_key).filter(Session.typeOfSession == str(request.typeOfSession))
+        schedule = getSchedule(conference_key)
+        rows, next_token = self._slicePage(
+            [schedule['rows'][i] for i in
+             schedule['types'].get(str(request.typeOfSession), [])],
+            request)
 
         # return set of SessionForm objects of a certain type
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=self._rowsToSessionForms(rows, self._isSummary(request)),
+            nextPageToken=next_token
         )
 
 # - - - Wishlist - - - - - - - - - - - - - - - - - - - -
 
-    @endpoints.method(SESS_GET_REQUEST, BooleanMessage,
+    @endpoints.method(SESS_GET_REQUEST, WishlistResultForm,
                       path='profile/wishlist/{websafeSessionKey}',
                       http_method='POST', name='addSessionToWishlist')
+    @instrumented
     def addSessionToWishlist(self, request):
-        """Adds a session to the user's wishlist"""
-        return self._sessionWishlist(request)
+        """Adds a session to the user's wishlist, flagging the wishlisted
+        sessions it overlaps"""
+        profile = self._getProfileFromUser()
+        session = self._getSession(request.websafeSessionKey)
+
+        conflicts = wishlist.addSession(profile.key, session)
+        if conflicts is None:
+            raise ConflictException(
+                "You already have this session in your wishlist"
+            )
+        return WishlistResultForm(
+            data=True,
+            conflictingSessionKeys=[key.urlsafe() for key in conflicts]
+        )
 
     @endpoints.method(SESS_GET_REQUEST, BooleanMessage,
                       path='profile/wishlist/{websafeSessionKey}',
                       http_method='DELETE', name='deleteSessionInWishlist')
+    @instrumented
     def deleteSessionInWishlist(self, request):
         """Deletes a session from a user's wishlist"""
-        return self._sessionWishlist(request, add=False)
+        profile = self._getProfileFromUser()
+        return BooleanMessage(
+            data=wishlist.removeSession(profile.key, request.websafeSessionKey))
 
-    @endpoints.method(message_types.VoidMessage, SessionForms,
+    @endpoints.method(WISHLIST_REQUEST, SessionForms,
                       path='profile/wishlist',
                       http_method='GET', name='getSessionsInWishlist')
+    @instrumented
     def getSessionsInWishlist(self, request):
-        """Returns the sessions in the user's wishlist"""
+        """Returns the sessions in the user's wishlist, optionally of one
+        conference, in schedule order"""
         profile = self._getProfileFromUser()
-        wishlist = profile.sessionWishlist
+        conference_key = None
+        if request.websafeConferenceKey:
+            conference_key = ndb.Key(urlsafe=request.websafeConferenceKey)
 
-        # create list of Session Key objects
-        session_keys = [(ndb.Key(urlsafe=session_key)) for session_key in wishlist]
-        sessions = ndb.get_multi(session_keys)
+        entry_keys, next_token = self._fetchPage(
+            wishlist.wishlistQuery(profile.key, conference_key), request,
+            keys_only=True)
+        sessions = entitycache.getMulti(
+            [ndb.Key(urlsafe=key.id()) for key in entry_keys])
+
+        # entries of sessions that were deleted are skipped and dropped
+        gone = [key for key, session in zip(entry_keys, sessions) if not session]
+        if gone:
+            ndb.delete_multi(gone)
 
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=self._copySessionsToForms(sessions, self._isSummary(request)),
+            nextPageToken=next_token
         )
 
-    def _sessionWishlist(self, request, add=True):
-        """Add or delete a session from a user's wishlist"""
-        profile = self._getProfileFromUser()
-        session_websafekey = request.websafeSessionKey
-        session = ndb.Key(urlsafe=session_websafekey).get()
-
+    def _getSession(self, websafeSessionKey):
+        """Return the Session for a websafe key, or raise NotFound."""
+        session_key = ndb.Key(urlsafe=websafeSessionKey)
+        session = entitycache.get(session_key) if session_key.kind() == 'Session' else None
         if not session:
             raise endpoints.NotFoundException(
-                'No session found with key: %s' % session_websafekey
+                'No session found with key: %s' % websafeSessionKey
             )
-
-        if add:
-            if session_websafekey in profile.sessionWishlist:
-                raise ConflictException(
-                    "You already have this session in your wishlist"
-                )
-            else:
-                profile.sessionWishlist.append(session_websafekey)
-                return_value = True
-        else:
-            if session_websafekey in profile.sessionWishlist:
-                profile.sessionWishlist.remove(session_websafekey)
-                return_value = True
-            else:
-                return_value = False
-
-        profile.put()
-
-        return BooleanMessage(data=return_value)
+        return session
 
 # - - - Sessions - - - - - - - - - - - - - - - - - - - -
 
     @endpoints.method(SESS_TIME_REQUEST, SessionForms,
                       path='getConferenceSessionsByTime',
                       http_method='GET', name='getConferenceSessionsByTime')
+    @instrumented
     def getConferenceSessionsByTime(self, request):
         """Gets all the Sessions for a Conference within a time period"""
 
@@ -847,69 +1422,70 @@ class ConferenceApi(remote.Service):
 
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
 
-        # add this to all time objects to get the right datetime for querying datastore
-        filler_date = datetime_date(1970, 1, 1)
-
-        date = datetime.strptime(data['conferenceDate'], "%Y-%m-%d")
-
-        startTime = datetime.strptime(data['startTime'], "%H:%M").time()
-        startDateTime = datetime.combine(date=filler_date, time=startTime)
-
-        endTime = datetime.strptime(data['endTime'], "%H:%M").time()
-        endDateTime = datetime.combine(date=filler_date, time=endTime)
+        # compare against the same string forms the schedule snapshot holds
+        date = str(datetime.strptime(data['conferenceDate'], "%Y-%m-%d").date())
+        startTime = str(datetime.strptime(data['startTime'], "%H:%M").time())
+        endTime = str(datetime.strptime(data['endTime'], "%H:%M").time())
 
-        dateFilter = ndb.query.FilterNode(
-            'date',
-            OPERATORS['EQ'],
-            date,
-        )
-
-        startTimeFilter = ndb.query.FilterNode(
-            'startTime',
-            OPERATORS['GTEQ'],
-            startDateTime,
-        )
-
-        endTimeFilter = ndb.query.FilterNode(
-            'startTime',
-            OPERATORS['LTEQ'],
-            endDateTime,
-        )
-
-        sessions = Session.query(ancestor=conference_key).filter(dateFilter)\
-           .filter(startTimeFilter).filter(endTimeFilter)
+        rows, next_token = self._slicePage(
+            [row for row in getSchedule(conference_key)['rows']
+             if row['date'] == date and startTime <= row['startTime'] <= endTime],
+            request)
 
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=self._rowsToSessionForms(rows, self._isSummary(request)),
+            nextPageToken=next_token
         )
 
-    @endpoints.method(message_types.VoidMessage, SessionForms,
+    @endpoints.method(SESS_LIST_REQUEST, SessionForms,
                       path='getAttendedConferenceSessions',
                       http_method='GET',
                       name='getAttendedConferenceSessions')
+    @instrumented
     def getAttendedConferenceSessions(self, request):
         """Gets all the Sessions in the Conferences that a user is attending"""
         conference_keys = self._getConferencesToAttend(request, forms=False)
+        page_size = self._pageSize(request)
+        summary = self._isSummary(request)
 
-        # get a list of queries, one for each conference attended
-        session_queries = []
-        for key in conference_keys:
-            session_queries.append(Session.query(ancestor=key))
+        # the page token holds the position in conference_keys plus the
+        # offset inside that conference's session list
+        index, offset = 0, 0
+        if request.pageToken:
+            try:
+                index, offset = map(int, base64.urlsafe_b64decode(
+                    str(request.pageToken)).split(':'))
+            except (TypeError, ValueError):
+                raise endpoints.BadRequestException("Invalid 'pageToken'")
 
-        # copy all sessions in those queries to a single list of forms
+        # fetch the sessions of several conferences at once and merge them
+        # in conference order until the page is full
         session_form_list = []
-        for session_query in session_queries:
-            for session in session_query:
-                session_form_list.append(self._copySessionToForm(session))
+        next_token = None
+        while index < len(conference_keys) and not next_token:
+            window = conference_keys[index:index + ATTENDED_SESSIONS_FANOUT]
+            for schedule in getSchedules(window):
+                rows = schedule['rows']
+                taken = rows[offset:offset + page_size - len(session_form_list)]
+                session_form_list.extend(self._rowsToSessionForms(taken, summary))
+                offset += len(taken)
+                if offset >= len(rows):
+                    index, offset = index + 1, 0
+                if len(session_form_list) >= page_size:
+                    if index < len(conference_keys):
+                        next_token = base64.urlsafe_b64encode('%d:%d' % (index, offset))
+                    break
 
         return SessionForms(
-            items=session_form_list
+            items=session_form_list,
+            nextPageToken=next_token
         )
 
     @endpoints.method(SessionTypeTimeForm, SessionForms,
                       path='getSessionsExcludeTypeTime',
                       http_method='GET',
                       name='getSessionsExcludeTypeTime')
+    @instrumented
     def getSessionsExcludeTypeTime(self, request):
         """Gets all Sessions not of the specified type and before the specified time"""
 
@@ -934,20 +1510,23 @@ class ConferenceApi(remote.Service):
         except (KeyError, ValueError):
             allowed_types = None
 
+        # one equality query per allowed type, run in parallel by the
+        # datastore and merged in startTime order; ordering by key last
+        # lets the merged query be paged with cursors
         sessions = Session.query()
-        if timeFilter:
-            sessions = sessions.filter(timeFilter)
-
         if allowed_types:
-            correct_sessions = []
-            for session in sessions:
-                    if session.typeOfSession in allowed_types:
-                        correct_sessions.append(session)
+            sessions = sessions.filter(Session.typeOfSession.IN(allowed_types))
+        if timeFilter:
+            sessions = sessions.filter(timeFilter).order(Session.startTime, Session.key)
         else:
-            correct_sessions = sessions
+            sessions = sessions.order(Session.key)
+
+        correct_sessions, next_token = self._fetchViewPage(sessions, request)
 
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in correct_sessions]
+            items=self._copySessionsToForms(correct_sessions,
+                                            self._isSummary(request)),
+            nextPageToken=next_token
         )
 
 # - - - Featured Speaker - - - - - - - - - - - - - - - - - - - -
@@ -955,34 +1534,80 @@ class ConferenceApi(remote.Service):
     @endpoints.method(message_types.VoidMessage, StringMessage,
                       path='getFeaturedSpeaker',
                       http_method='GET', name='getFeaturedSpeaker')
+    @instrumented
     def getFeaturedSpeaker(self, request):
-        """Return Featured speaker from memcache"""
-        return StringMessage(data=str(memcache.get(MEMCACHE_FEATURED_SPEAKER_KEY)) or "")
+        """Return the most recently featured speaker of any conference"""
+        return StringMessage(data=memcache.get(MEMCACHE_FEATURED_SPEAKER_KEY) or "")
+
+
+    @endpoints.method(CONF_GET_REQUEST, FeaturedSpeakerForm,
+                      path='conference/{websafeConferenceKey}/featuredSpeaker',
+                      http_method='GET', name='getConferenceFeaturedSpeaker')
+    @instrumented
+    def getConferenceFeaturedSpeaker(self, request):
+        """Return the featured speaker of a conference"""
+        wsck = request.websafeConferenceKey
+        featured = memcache.get(MEMCACHE_CONFERENCE_FEATURED_SPEAKER_KEY % wsck)
+        if featured is None:
+            # evicted or never set: recompute from the speaker index; add()
+            # leaves any value a featured speaker task set meanwhile alone
+            featured = ConferenceApi._computeFeaturedSpeaker(ndb.Key(urlsafe=wsck))
+            memcache.add(MEMCACHE_CONFERENCE_FEATURED_SPEAKER_KEY % wsck, featured)
+        return FeaturedSpeakerForm(
+            websafeConferenceKey=wsck,
+            speaker=featured.get('speaker'),
+            sessionNames=featured.get('sessions', []),
+        )
 
 
     @staticmethod
-    def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
-        """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
-
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = ANNOUNCEMENT_TPL % (
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+    def _featuredSpeakerDict(speaker_entity, conference_key):
+        """Return the cached featured speaker value for one conference."""
+        # getting sessions from speaker in the same conference
+        sessions = ndb.get_multi([key for key in speaker_entity.sessionKeys
+                                  if key.parent() == conference_key])
+        names = [session.name for session in sessions if session]
+        return {'speaker': speaker_entity.name, 'sessions': names,
+                'count': len(names)}
+
+
+    @staticmethod
+    def _computeFeaturedSpeaker(conference_key):
+        """Pick the speaker with the most (and at least 2) sessions at the
+        conference from the datastore; {} if there is none."""
+        wsck = conference_key.urlsafe()
+        speakers = [speaker for speaker in
+                    Speaker.query(Speaker.conferenceKeys == conference_key)
+                    if (speaker.conferenceCounts or {}).get(wsck, 0) >= 2]
+        if not speakers:
+            return {}
+        best = max(speakers, key=lambda speaker: speaker.conferenceCounts[wsck])
+        return ConferenceApi._featuredSpeakerDict(best, conference_key)
+
+
+    @staticmethod
+    def _recomputeFeaturedSpeaker(conference_websafekey):
+        """Recompute a conference's featured speaker from the datastore,
+        e.g. after a bulk import."""
+        featured = ConferenceApi._computeFeaturedSpeaker(
+            ndb.Key(urlsafe=conference_websafekey))
+        memcache.set(MEMCACHE_CONFERENCE_FEATURED_SPEAKER_KEY % conference_websafekey,
+                     featured)
+        if featured:
+            memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY, FEATURED_SPEAKER_TPL % (
+                featured['speaker'], ', '.join(featured['sessions'])))
+
+
+    @staticmethod
+    def _preferFeatured(current, candidate):
+        """Return whichever of two featured speaker dicts has more
+        sessions; candidate, the newer, wins ties and replaces an older
+        copy of the same speaker."""
+        if (not current or current.get('speaker') == candidate['speaker'] or
+                candidate['count'] >= current.get('count', 0)):
+            return candidate
+        return current
 
-        return announcement
 
     @staticmethod
     def _cacheFeaturedSpeaker(speaker, conference_websafekey):
@@ -991,25 +1616,42 @@ class ConferenceApi(remote.Service):
         """
         conference_key = ndb.Key(urlsafe=conference_websafekey)
 
-        # getting sessions from speaker in the same conference
-        sessions = Session.query(ancestor=conference_key).filter(Session.speaker == speaker)
-
-        # if speaker has 2 or more sessions at the conference, set new featured speaker
-        if sessions.count() >= 2:
-            speaker_dict = {'speaker': speaker}
-
-            list_of_session_names = []
-            for session in sessions:
-                list_of_session_names.append(session.name)
-            speaker_dict['sessions'] = list_of_session_names
-
-            memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY, speaker_dict)
+        # the speaker index counts the speaker's sessions per conference
+        speaker_entity = getSpeaker(speaker)
+        counts = (speaker_entity and speaker_entity.conferenceCounts) or {}
+
+        # only a speaker with 2 or more sessions at the conference can be featured
+        if counts.get(conference_websafekey, 0) < 2:
+            return
+        candidate = ConferenceApi._featuredSpeakerDict(speaker_entity, conference_key)
+
+        # tasks for the same conference run in parallel: compare-and-set so
+        # no update is lost. The speaker with the most sessions stays
+        # featured; on a tie the newest one wins.
+        client = memcache.Client()
+        key = MEMCACHE_CONFERENCE_FEATURED_SPEAKER_KEY % conference_websafekey
+        for _ in range(FEATURED_SPEAKER_CAS_RETRIES):
+            current = client.gets(key)
+            if current is None:
+                # nothing cached; the Speaker query is only eventually
+                # consistent, the keyed read behind candidate is not
+                featured = ConferenceApi._preferFeatured(
+                    ConferenceApi._computeFeaturedSpeaker(conference_key),
+                    candidate)
+                if client.add(key, featured):
+                    break
+                continue
+            featured = ConferenceApi._preferFeatured(current, candidate)
+            if featured == current:
+                return
+            if client.cas(key, featured):
+                break
         else:
-            data = memcache.get(MEMCACHE_FEATURED_SPEAKER_KEY)
+            return
 
-            # if memcache entry doesn't exist already, set it to an empty string
-            if not data:
-                memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY, '')
+        if featured:
+            memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY, FEATURED_SPEAKER_TPL % (
+                featured['speaker'], ', '.join(featured['sessions'])))
 
 
 api = endpoints.api_server([ConferenceApi]) # register API
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""conferencesearch.py
+
+Full-text and faceted conference search on the App Engine Search API.
+
+Every Conference has a document in the "conferences" index, keyed by its
+websafe key, with its name, description, topics and city as text and its
+city, topics and month as facets. Documents are written by
+/tasks/index_conference after a conference is created or updated;
+/tasks/reindex_conferences backfills existing conferences.
+
+"""
+
+from google.appengine.api import search
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Conference
+from utils import addTaskAsync
+
+INDEX_NAME = 'conferences'
+REINDEX_BATCH_SIZE = 200        # documents per Index.put(), the API maximum
+FACETS = ('city', 'topic', 'month')
+FACET_VALUES = 10               # values returned per facet
+
+
+def _index():
+    return search.Index(name=INDEX_NAME)
+
+
+def _document(conf):
+    """Build the search document of a Conference."""
+    fields = [
+        search.TextField(name='name', value=conf.name),
+        search.TextField(name='description', value=conf.description or ''),
+        search.TextField(name='topics', value=' '.join(conf.topics)),
+        search.TextField(name='city', value=conf.city or ''),
+    ]
+    facets = [search.AtomFacet(name='topic', value=topic)
+              for topic in conf.topics if topic]
+    if conf.city:
+        facets.append(search.AtomFacet(name='city', value=conf.city))
+    if conf.month:
+        facets.append(search.AtomFacet(name='month', value=str(conf.month)))
+    return search.Document(doc_id=conf.key.urlsafe(), fields=fields,
+                           facets=facets)
+
+
+def indexConference(wsck):
+    """Write (or remove) the search document of conference wsck."""
+    conf = ndb.Key(urlsafe=wsck).get()
+    if conf:
+        _index().put(_document(conf))
+    else:
+        _index().delete(wsck)
+
+
+def conferenceChanged(wsck):
+    """Queue the search document update of conference wsck."""
+    conferenceChangedAsync(wsck).get_result()
+
+
+@ndb.tasklet
+def conferenceChangedAsync(wsck):
+    """Async conferenceChanged()."""
+    yield addTaskAsync('/tasks/index_conference',
+                       params={'websafeConferenceKey': wsck})
+
+
+def reindexConferences(cursor=None):
+    """Index one batch of Conferences, chaining a task for the next."""
+    confs, next_cursor, more = Conference.query().fetch_page(
+        REINDEX_BATCH_SIZE, start_cursor=cursor)
+    if confs:
+        _index().put([_document(conf) for conf in confs])
+    if more and next_cursor:
+        taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                      url='/tasks/reindex_conferences')
+
+
+def searchConferences(query_string, limit, page_token=None, refinements=None):
+    """Run a ranked search.
+
+    refinements maps facet names to the values results must have. Returns
+    the matching Conference keys in rank order, the next page token or
+    None, the total number of matches and a list of
+    (facet, [(value, count)]) pairs. Raises search.QueryError for a
+    malformed query string and ValueError for a bad page token.
+    """
+    options = search.QueryOptions(
+        limit=limit,
+        cursor=search.Cursor(web_safe_string=page_token) if page_token
+               else search.Cursor(),
+        sort_options=search.SortOptions(match_scorer=search.MatchScorer()),
+        ids_only=True)
+    query = search.Query(
+        query_string=query_string or '',
+        options=options,
+        return_facets=[search.FacetRequest(name, value_limit=FACET_VALUES)
+                       for name in FACETS],
+        facet_refinements=[search.FacetRefinement(name=name, value=value)
+                           for name, value in (refinements or {}).items()
+                           if value])
+    results = _index().search(query)
+    keys = [ndb.Key(urlsafe=doc.doc_id) for doc in results.results]
+    next_token = results.cursor.web_safe_string if results.cursor else None
+    facets = [(facet.name, [(value.label, value.count)
+                            for value in facet.values])
+              for facet in results.facets]
+    return keys, next_token, results.number_found, facets
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+"""converters.py
+
+Entity to ProtoRPC message converters.
+
+Each converter decides once, at import, which form fields come from which
+model properties and how their values are converted (dates and times to
+strings, strings to enums). Copying an entity is then a single pass over
+a short list instead of all_fields()/hasattr/name checks for every field
+of every row.
+
+Rows are not check_initialized() one by one: the endpoints framework
+validates the complete response message when it encodes it.
+
+"""
+
+from google.appengine.ext import ndb
+from protorpc import messages
+
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+from models import ProfileForm
+from models import Session
+from models import SessionForm
+
+
+def _enumConverter(enum_type):
+    def convert(value):
+        return getattr(enum_type, value) if value is not None else None
+    return convert
+
+
+def _valueConverter(prop, field):
+    """Return the function turning prop's value into field's, or None if
+    the value can be copied as is."""
+    if isinstance(prop, (ndb.DateProperty, ndb.TimeProperty)):
+        # historical output format, None included
+        return str
+    if isinstance(field, messages.EnumField):
+        return _enumConverter(field.type)
+    return None
+
+
+class Converter(object):
+    """Copies entities of one model onto one message class."""
+
+    def __init__(self, model_cls, form_cls, key_field=None, fields=None):
+        self.form_cls = form_cls
+        self.key_field = key_field
+        self.copied = []            # fields copied as is
+        self.converted = []         # (field, converter) pairs
+        for field in form_cls.all_fields():
+            prop = model_cls._properties.get(field.name)
+            if prop is None or (fields and field.name not in fields):
+                continue
+            convert = _valueConverter(prop, field)
+            if convert is None:
+                self.copied.append(field.name)
+            else:
+                self.converted.append((field.name, convert))
+
+    def toForm(self, entity, **extra):
+        """Return the form for entity; extra sets additional fields."""
+        values = {}
+        for name in self.copied:
+            value = getattr(entity, name)
+            if value is not None and value != []:
+                values[name] = value
+        for name, convert in self.converted:
+            values[name] = convert(getattr(entity, name))
+        if self.key_field:
+            values[self.key_field] = entity.key.urlsafe()
+        values.update(extra)
+        return self.form_cls(**values)
+
+    def toForms(self, entities):
+        """Return forms for entities, skipping missing (None) ones."""
+        toForm = self.toForm
+        return [toForm(entity) for entity in entities if entity is not None]
+
+
+# fields of a Profile shown to conference organizers
+ATTENDEE_FIELDS = ('displayName', 'mainEmail', 'teeShirtSize')
+# fields returned by the SUMMARY view of listing endpoints
+CONFERENCE_SUMMARY_FIELDS = ('name', 'city', 'topics', 'startDate', 'endDate',
+                             'month')
+SESSION_SUMMARY_FIELDS = ('name', 'speaker', 'duration', 'typeOfSession',
+                          'date', 'startTime', 'websafeSessionKey')
+
+CONFERENCE_CONVERTER = Converter(Conference, ConferenceForm, key_field='websafeKey')
+CONFERENCE_SUMMARY_CONVERTER = Converter(Conference, ConferenceForm,
+                                         key_field='websafeKey',
+                                         fields=CONFERENCE_SUMMARY_FIELDS)
+PROFILE_CONVERTER = Converter(Profile, ProfileForm)
+ATTENDEE_CONVERTER = Converter(Profile, ProfileForm, fields=ATTENDEE_FIELDS)
+SESSION_CONVERTER = Converter(Session, SessionForm, key_field='websafeSessionKey')
+SESSION_SUMMARY_CONVERTER = Converter(Session, SessionForm,
+                                      key_field='websafeSessionKey',
+                                      fields=SESSION_SUMMARY_FIELDS)
+
+_sessionType = SessionForm.field_by_name('typeOfSession').type
+
+
+def sessionRowToForm(row, fields=None):
+    """Return the SessionForm for a schedule snapshot row, limited to
+    fields if given."""
+    if fields:
+        values = dict((name, row[name]) for name in fields)
+    else:
+        values = dict(row)
+    values['typeOfSession'] = getattr(_sessionType, row['typeOfSession'])
+    return SessionForm(**values)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+"""entitycache.py
+
+Read-through cache for Conference, Profile and Session lookups.
+
+Entities are looked up in a small in-instance cache first, then in
+memcache, and only then in the datastore; misses are filled with one
+batched get_multi. Writers call invalidate() with the keys they changed.
+The in-instance copy is kept only for a few seconds because other
+instances cannot invalidate it.
+
+A reader that misses first adds a lease to memcache, and only stores
+what it read with compare-and-set against that lease. An invalidate()
+between the read and the store deletes the lease, so the store fails and
+an entity read before a write can never be cached after it.
+
+"""
+
+import cPickle as pickle
+import collections
+import os
+import threading
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+MEMCACHE_ENTITY_KEY = "ENTITY:%s"
+
+# memcache time-to-live per kind, in seconds; other kinds bypass the cache
+KIND_TTLS = {
+    'Conference': 60,
+    'Profile': 300,
+    'Session': 300,
+}
+LOCAL_TTL = 5
+LEASE_TTL = 10                  # seconds a reader may take to fill a miss
+LEASE_PREFIX = 'lease:'
+LOCAL_MAX_ENTRIES = 2000
+
+_local = collections.OrderedDict()
+_lock = threading.Lock()
+_stats = collections.defaultdict(int)
+
+
+def _count(kind, what, n=1):
+    if n:
+        with _lock:
+            _stats['%s.%s' % (kind, what)] += n
+
+
+def _localGet(ckey):
+    with _lock:
+        item = _local.get(ckey)
+        if item and item[0] < time.time():
+            del _local[ckey]
+            item = None
+    return item and item[1]
+
+
+def _localSet(ckey, data):
+    with _lock:
+        _local.pop(ckey, None)
+        _local[ckey] = (time.time() + LOCAL_TTL, data)
+        while len(_local) > LOCAL_MAX_ENTRIES:
+            _local.popitem(last=False)
+
+
+def get(key):
+    """Return the entity for key, or None if it does not exist."""
+    return getMulti([key])[0]
+
+
+def getMulti(keys):
+    """Return the entities for keys (None where missing), in key order."""
+    keys = list(keys)
+    if ndb.in_transaction():
+        # transactions must see (and lock) the datastore copy
+        return ndb.get_multi(keys)
+
+    results = [None] * len(keys)
+    pending = {}                # cache key -> positions still to fill
+    for pos, key in enumerate(keys):
+        if key is None:
+            continue
+        if key.kind() not in KIND_TTLS:
+            pending.setdefault(None, []).append(pos)
+            continue
+        ckey = MEMCACHE_ENTITY_KEY % key.urlsafe()
+        data = _localGet(ckey)
+        if data is not None:
+            results[pos] = pickle.loads(data)
+            _count(key.kind(), 'local_hits')
+        else:
+            pending.setdefault(ckey, []).append(pos)
+
+    uncached = pending.pop(None, [])
+    if pending:
+        found = memcache.get_multi(pending.keys())
+        for ckey, data in found.items():
+            if data.startswith(LEASE_PREFIX):
+                # another reader is filling it; read the datastore
+                del found[ckey]
+        for ckey, data in found.iteritems():
+            _localSet(ckey, data)
+            for pos in pending.pop(ckey):
+                results[pos] = pickle.loads(data)
+                _count(keys[pos].kind(), 'memcache_hits')
+
+    # one batched datastore round trip for everything still missing
+    misses = [pos for positions in pending.itervalues() for pos in positions]
+    fetch = misses + uncached
+    if fetch:
+        # lease the misses before reading them; the cas ids are fetched
+        # while the datastore is read
+        client = memcache.Client()
+        token = LEASE_PREFIX + os.urandom(8).encode('hex')
+        lease_rpc = None
+        if pending:
+            not_added = client.add_multi(dict.fromkeys(pending, token),
+                                         time=LEASE_TTL)
+            leased = [ckey for ckey in pending if ckey not in not_added]
+            if leased:
+                lease_rpc = client.get_multi_async(leased, for_cas=True)
+        entities = ndb.get_multi_async([keys[pos] for pos in fetch])
+        leases = lease_rpc.get_result() if lease_rpc else {}
+        fill = collections.defaultdict(dict)
+        for pos, entity in zip(fetch, entities):
+            entity = results[pos] = entity.get_result()
+            kind = keys[pos].kind()
+            if kind not in KIND_TTLS:
+                continue
+            _count(kind, 'misses')
+            ckey = MEMCACHE_ENTITY_KEY % keys[pos].urlsafe()
+            if entity is not None and leases.get(ckey) == token:
+                fill[kind][ckey] = pickle.dumps(entity, pickle.HIGHEST_PROTOCOL)
+        for kind, mapping in fill.iteritems():
+            # keys invalidated since they were leased are not stored
+            not_stored = client.cas_multi(mapping, time=KIND_TTLS[kind])
+            for ckey, data in mapping.iteritems():
+                if ckey not in not_stored:
+                    _localSet(ckey, data)
+    return results
+
+
+def invalidate(*keys):
+    """Drop keys from the cache after their entities were written."""
+    ckeys = [MEMCACHE_ENTITY_KEY % key.urlsafe() for key in keys
+             if key is not None and key.kind() in KIND_TTLS]
+    if not ckeys:
+        return
+    with _lock:
+        for ckey in ckeys:
+            _local.pop(ckey, None)
+    memcache.delete_multi(ckeys)
+    for key in keys:
+        if key is not None and key.kind() in KIND_TTLS:
+            _count(key.kind(), 'invalidations')
+
+
+def getStats():
+    """Return this instance's hit/miss counters, e.g. 'Profile.misses'."""
+    with _lock:
+        return dict(_stats)
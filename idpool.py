@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+"""idpool.py
+
+In-instance pools of reserved datastore ids.
+
+Session ids are allocated under their Conference, so every create used
+to spend an allocate_ids round trip before its put. Ids are instead
+reserved POOL_BATCH at a time per (kind, parent) and handed out from
+memory. Once a pool runs down to REFILL_AT ids, the next range is
+requested in the background of the request taking the id, so it usually
+arrives while that request's put is in flight. A bulk take of n ids needs
+at most one allocation, whatever n. Pooled ids come from allocate_ids, so
+they never collide with ids allocated elsewhere; ids left in a pool when
+an instance goes away are only gaps.
+
+A pool only pays off for parents that get many children on one
+instance. Conferences, whose parent is the organizer's Profile, use
+randomId() instead: a random id from a range above any id allocate_ids
+hands out, so it needs no RPC and can't collide with allocated ids.
+
+"""
+
+import collections
+import random
+import threading
+
+from google.appengine.ext import ndb
+
+POOL_BATCH = 10                 # ids reserved per refill
+REFILL_AT = 2                   # start the next refill at this many left
+MAX_POOLS = 1000                # parents kept per instance, least recent go
+# random ids are drawn from [2^56, 2^63); allocated ids stay below 2^53
+RANDOM_ID_MIN = 1 << 56
+RANDOM_ID_MAX = (1 << 63) - 1
+
+_pools = collections.OrderedDict()
+_lock = threading.Lock()
+_random = random.SystemRandom()
+
+
+class _Pool(object):
+    def __init__(self):
+        self.ids = collections.deque()
+        # (context, future) of the refill in flight, if any
+        self.refill = None
+
+
+def _getPool(model_cls, parent):
+    key = (model_cls._get_kind(), parent)
+    with _lock:
+        pool = _pools.pop(key, None) or _Pool()
+        _pools[key] = pool
+        while len(_pools) > MAX_POOLS:
+            _pools.popitem(last=False)
+    return pool
+
+
+def _take(pool, n):
+    with _lock:
+        if len(pool.ids) < n:
+            return None
+        return [pool.ids.popleft() for _ in range(n)]
+
+
+@ndb.tasklet
+def _allocate(model_cls, parent, size):
+    first, last = yield model_cls.allocate_ids_async(size=size, parent=parent)
+    raise ndb.Return(range(first, last + 1))
+
+
+@ndb.tasklet
+def _refill(pool, model_cls, parent):
+    ids = yield _allocate(model_cls, parent, POOL_BATCH)
+    with _lock:
+        pool.ids.extend(ids)
+
+
+def _refillAhead(pool, model_cls, parent):
+    """Start the next refill of a pool that is running low. The refill
+    runs on the current request's event loop; one started by another
+    request doesn't count, as it may never complete."""
+    ctx = ndb.get_context()
+    with _lock:
+        if len(pool.ids) > REFILL_AT:
+            return
+        if pool.refill and pool.refill[0] is ctx and not pool.refill[1].done():
+            return
+    # two requests refilling at once only reserve a few ids too many
+    future = _refill(pool, model_cls, parent)
+    with _lock:
+        pool.refill = (ctx, future)
+
+
+@ndb.tasklet
+def takeIdsAsync(model_cls, parent, n=1):
+    """Return n reserved ids for new model_cls entities under parent."""
+    pool = _getPool(model_cls, parent)
+    ids = _take(pool, n)
+    if ids is None:
+        # one allocation covers this take and refills the pool
+        ids = yield _allocate(model_cls, parent, n + POOL_BATCH)
+        with _lock:
+            pool.ids.extend(ids[n:])
+        ids = ids[:n]
+    else:
+        _refillAhead(pool, model_cls, parent)
+    raise ndb.Return(ids)
+
+
+def takeIds(model_cls, parent, n):
+    """Sync takeIdsAsync()."""
+    return takeIdsAsync(model_cls, parent, n).get_result()
+
+
+@ndb.tasklet
+def takeIdAsync(model_cls, parent):
+    """Return one reserved id for a new model_cls entity under parent."""
+    ids = yield takeIdsAsync(model_cls, parent, 1)
+    raise ndb.Return(ids[0])
+
+
+def randomId():
+    """Return a random id for a new entity, for parents too short-lived
+    to keep a pool; the chance of two ids meeting under one parent is
+    negligible."""
+    return _random.randint(RANDOM_ID_MIN, RANDOM_ID_MAX)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+"""instrumentation.py
+
+Per-endpoint RPC accounting and slow-request tracing.
+
+ConferenceApi methods are wrapped with @instrumented. While one runs,
+apiproxy hooks record every API call it makes (datastore, memcache,
+taskqueue, urlfetch, search, ...): the calls per service, their wall time
+and request/response bytes, and the app code each call came from. When
+the method returns, its totals are added to memcache counters with one
+offset_multi() call that is not waited on, so it overlaps with encoding
+the response, and a request slower than SLOW_REQUEST_MS is logged as a
+JSON record with its most expensive call sites.
+
+getStats() returns the counters per endpoint, plus this instance's call
+site totals; /admin/rpc_stats serves them.
+
+"""
+
+import collections
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+
+SLOW_REQUEST_MS = 1000
+SLOW_CALL_SITES = 10            # call sites in a slow request log record
+MAX_CALL_SITES = 500            # per-instance call site totals kept
+SERVICES = ('datastore_v3', 'memcache', 'taskqueue', 'urlfetch', 'search',
+            'mail')
+METRICS = ('calls', 'errors', 'slow', 'millis', 'rpcMillis',
+           'requestBytes', 'responseBytes') + \
+          tuple('rpcs.%s' % service for service in SERVICES + ('other',))
+MEMCACHE_STATS_KEY = 'RPC_STATS:%s'
+
+APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+_THIS_MODULE = os.path.splitext(os.path.abspath(__file__))[0]
+
+_endpoints = []
+_local = threading.local()
+_lock = threading.Lock()
+_callSites = collections.OrderedDict()  # site -> [calls, millis]
+_appCode = {}                           # code object -> in the app?
+
+
+class _Trace(object):
+    """RPCs of one endpoint call."""
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.start = time.time()
+        self.rpcs = collections.Counter()
+        self.rpcMillis = 0.0
+        self.requestBytes = 0
+        self.responseBytes = 0
+        self.sites = {}                 # site -> [calls, millis]
+        self.pending = {}               # id(request) -> (start, site)
+        self.error = None
+
+
+def _size(pb):
+    try:
+        return pb.ByteSize()
+    except Exception:
+        return 0
+
+
+def _isAppCode(code):
+    in_app = _appCode.get(code)
+    if in_app is None:
+        path = os.path.abspath(code.co_filename)
+        in_app = _appCode[code] = (os.path.dirname(path) == APP_ROOT and
+                                   os.path.splitext(path)[0] != _THIS_MODULE)
+    return in_app
+
+
+def _callSite():
+    """Return "module.py:line function" of the innermost app frame."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        if _isAppCode(frame.f_code):
+            return '%s:%d %s' % (os.path.basename(frame.f_code.co_filename),
+                                 frame.f_lineno, frame.f_code.co_name)
+        frame = frame.f_back
+    return 'unknown'
+
+
+def _beforeRpc(service, call, request, response, rpc):
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return
+    trace.rpcs[service if service in SERVICES else 'other'] += 1
+    trace.requestBytes += _size(request)
+    site = '%s %s.%s' % (_callSite(), service, call)
+    trace.pending[id(request)] = (time.time(), site)
+
+
+def _afterRpc(service, call, request, response, rpc):
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return
+    started = trace.pending.pop(id(request), None)
+    if started is None:
+        return
+    millis = (time.time() - started[0]) * 1000
+    trace.rpcMillis += millis
+    trace.responseBytes += _size(response)
+    site = trace.sites.setdefault(started[1], [0, 0.0])
+    site[0] += 1
+    site[1] += millis
+
+
+apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('instrumentation', _beforeRpc)
+apiproxy_stub_map.apiproxy.GetPostCallHooks().Append('instrumentation', _afterRpc)
+
+
+def _record(trace, millis):
+    """Add a finished trace to the counters."""
+    slow = millis > SLOW_REQUEST_MS
+    counts = {
+        'calls': 1,
+        'errors': 1 if trace.error else 0,
+        'slow': 1 if slow else 0,
+        'millis': int(millis),
+        'rpcMillis': int(trace.rpcMillis),
+        'requestBytes': trace.requestBytes,
+        'responseBytes': trace.responseBytes,
+    }
+    for service, n in trace.rpcs.items():
+        counts['rpcs.%s' % service] = n
+    # not waited on: losing a few counts beats a blocking RPC per request
+    memcache.Client().offset_multi_async(
+        dict(('%s.%s' % (trace.endpoint, metric), n)
+             for metric, n in counts.items() if n),
+        key_prefix=MEMCACHE_STATS_KEY % '', initial_value=0)
+
+    with _lock:
+        for site, (calls, site_millis) in trace.sites.items():
+            totals = _callSites.pop(site, None) or [0, 0.0]
+            totals[0] += calls
+            totals[1] += site_millis
+            _callSites[site] = totals
+        while len(_callSites) > MAX_CALL_SITES:
+            _callSites.popitem(last=False)
+
+    if slow:
+        sites = sorted(trace.sites.items(), key=lambda item: -item[1][1])
+        logging.warning('Slow request: %s', json.dumps({
+            'endpoint': trace.endpoint,
+            'millis': int(millis),
+            'error': trace.error,
+            'rpcs': dict(trace.rpcs),
+            'rpcMillis': int(trace.rpcMillis),
+            'requestBytes': trace.requestBytes,
+            'responseBytes': trace.responseBytes,
+            'callSites': [{'site': site, 'calls': calls, 'millis': int(ms)}
+                          for site, (calls, ms) in sites[:SLOW_CALL_SITES]],
+        }, sort_keys=True))
+
+
+def instrumented(func):
+    """Trace the RPCs of an endpoint method; goes below @endpoints.method."""
+    _endpoints.append(func.__name__)
+
+    @functools.wraps(func)
+    def wrapper(self, request):
+        if getattr(_local, 'trace', None) is not None:
+            # called from another endpoint method, which is traced already
+            return func(self, request)
+        trace = _local.trace = _Trace(func.__name__)
+        try:
+            return func(self, request)
+        except Exception as e:
+            trace.error = type(e).__name__
+            raise
+        finally:
+            _local.trace = None
+            millis = (time.time() - trace.start) * 1000
+            try:
+                _record(trace, millis)
+            except Exception:
+                logging.exception('Recording the RPC stats of %s failed',
+                                  trace.endpoint)
+    return wrapper
+
+
+def getStats():
+    """Return the counters per endpoint, with per-call averages, and this
+    instance's call sites by total RPC time."""
+    keys = ['%s.%s' % (endpoint, metric)
+            for endpoint in _endpoints for metric in METRICS]
+    counts = memcache.get_multi(keys, key_prefix=MEMCACHE_STATS_KEY % '')
+    endpoints = {}
+    for endpoint in _endpoints:
+        stats = dict((metric, counts.get('%s.%s' % (endpoint, metric), 0))
+                     for metric in METRICS)
+        if not stats['calls']:
+            continue
+        for metric in ('millis', 'rpcMillis', 'requestBytes', 'responseBytes'):
+            stats[metric + 'PerCall'] = round(
+                stats[metric] / float(stats['calls']), 1)
+        stats['rpcsPerCall'] = round(sum(
+            stats['rpcs.%s' % service] for service in SERVICES + ('other',))
+            / float(stats['calls']), 2)
+        endpoints[endpoint] = stats
+    with _lock:
+        sites = sorted(_callSites.items(), key=lambda item: -item[1][1])
+    return {
+        'slowRequestMillis': SLOW_REQUEST_MS,
+        'endpoints': endpoints,
+        'instanceCallSites': [{'site': site, 'calls': calls, 'millis': int(ms)}
+                              for site, (calls, ms) in sites],
+    }
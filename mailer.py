@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+"""mailer.py
+
+Batched confirmation emails.
+
+Notifications are added to the "mail" pull queue, tagged with their
+recipient, instead of each getting its own push task. /tasks/flush_mail
+(queued at most once per FLUSH_WINDOW, plus a cron safety net) leases
+pending notifications, coalesces them into one message per recipient
+rendered from templates/confirmation_email.txt, and sends with at most
+SEND_CONCURRENCY messages in flight, retrying with backoff. Tasks are
+only deleted once their message went out; failed ones come back when
+their lease expires.
+
+Throughput counters are kept in memcache (see getMetrics()). Tests can
+swap the mail backend with setBackend(FakeMailBackend()).
+
+"""
+
+import json
+import logging
+import os
+import string
+import threading
+import time
+import Queue
+
+from google.appengine.api import app_identity
+from google.appengine.api import mail
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+
+MAIL_QUEUE = 'mail'
+FLUSH_WINDOW = 10               # seconds between flushes while mail arrives
+LEASE_SECONDS = 120
+LEASE_BATCH = 100               # tasks leased at a time, the API maximum
+MAX_FLUSH_BATCHES = 10          # per flush request; the next flush continues
+SEND_CONCURRENCY = 5
+SEND_ATTEMPTS = 3
+SEND_BACKOFF = 0.5              # seconds, doubled after each failed attempt
+MAX_TASK_LEASES = 5             # give up on a notification after this many
+MEMCACHE_METRICS_KEY = 'MAIL_METRICS:%s'
+METRICS = ('enqueued', 'leased', 'sent', 'failed', 'dropped', 'batches',
+           'sendMillis')
+
+SUBJECT = 'You created a new Conference!'
+CONFERENCE_LINE = string.Template('- $name, $city, $startDate to $endDate')
+
+with open(os.path.join(os.path.dirname(__file__), 'templates',
+                       'confirmation_email.txt')) as f:
+    BODY = string.Template(f.read())
+
+
+class AppEngineMailBackend(object):
+    """Sends through the App Engine mail API."""
+    def send(self, sender, to, subject, body):
+        mail.send_mail(sender, to, subject, body)
+
+
+class FakeMailBackend(object):
+    """Keeps messages in outbox instead of sending them; the first
+    `failures` sends raise, to exercise the retries."""
+    def __init__(self, failures=0):
+        self.outbox = []
+        self.failures = failures
+        self._lock = threading.Lock()
+
+    def send(self, sender, to, subject, body):
+        with self._lock:
+            if self.failures > 0:
+                self.failures -= 1
+                raise mail.Error('fake failure')
+            self.outbox.append((sender, to, subject, body))
+
+
+_backend = AppEngineMailBackend()
+
+
+def setBackend(backend):
+    """Replace the mail backend, returning the previous one."""
+    global _backend
+    previous, _backend = _backend, backend
+    return previous
+
+
+def _count(metric, n=1):
+    if n:
+        memcache.incr(MEMCACHE_METRICS_KEY % metric, n, initial_value=0)
+
+
+def getMetrics():
+    """Return the mail counters since memcache last dropped them."""
+    counts = memcache.get_multi(METRICS, key_prefix=MEMCACHE_METRICS_KEY % '')
+    metrics = dict((metric, counts.get(metric, 0)) for metric in METRICS)
+    metrics['messagesPerSecond'] = round(
+        metrics['sent'] * 1000.0 / metrics['sendMillis'], 2) \
+        if metrics['sendMillis'] else 0.0
+    return metrics
+
+
+def _scheduleFlush():
+    """Queue at most one flush per FLUSH_WINDOW."""
+    try:
+        taskqueue.add(name='flush-mail-%d' % int(time.time() / FLUSH_WINDOW),
+                      url='/tasks/flush_mail', countdown=FLUSH_WINDOW)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def enqueueConfirmation(email, conference):
+    """Queue a confirmation for email about conference, a dict with name,
+    city, startDate and endDate."""
+    taskqueue.Queue(MAIL_QUEUE).add(taskqueue.Task(
+        payload=json.dumps(conference), method='PULL', tag=email))
+    _count('enqueued')
+    _scheduleFlush()
+
+
+def _render(conferences):
+    lines = [CONFERENCE_LINE.safe_substitute(
+                 dict((k, v or '') for k, v in conf.items()))
+             for conf in conferences]
+    return BODY.safe_substitute(conferences='\n'.join(lines))
+
+
+def _sendWithRetry(sender, to, body):
+    wait = SEND_BACKOFF
+    for attempt in range(SEND_ATTEMPTS):
+        try:
+            _backend.send(sender, to, SUBJECT, body)
+            return True
+        except Exception:
+            logging.warning('Sending mail to %s failed (attempt %d)',
+                            to, attempt + 1, exc_info=True)
+            if attempt + 1 < SEND_ATTEMPTS:
+                time.sleep(wait)
+                wait *= 2
+    return False
+
+
+def _sendAll(messages):
+    """Send (to, body, tasks) messages with bounded concurrency; returns
+    the tasks of the messages that went out."""
+    sender = 'noreply@%s.appspotmail.com' % app_identity.get_application_id()
+    pending = Queue.Queue()
+    for message in messages:
+        pending.put(message)
+    done = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            try:
+                to, body, tasks = pending.get_nowait()
+            except Queue.Empty:
+                return
+            if _sendWithRetry(sender, to, body):
+                with lock:
+                    done.extend(tasks)
+
+    workers = [threading.Thread(target=worker)
+               for _ in range(min(SEND_CONCURRENCY, len(messages)))]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return done
+
+
+def flushMail():
+    """Send the pending confirmations, one message per recipient. Returns
+    the number of messages sent."""
+    queue = taskqueue.Queue(MAIL_QUEUE)
+    sent = 0
+    for _ in range(MAX_FLUSH_BATCHES):
+        tasks = queue.lease_tasks(LEASE_SECONDS, LEASE_BATCH)
+        if not tasks:
+            return sent
+        _count('leased', len(tasks))
+
+        # notifications that keep failing are dropped, not retried forever
+        stale = [task for task in tasks if task.retry_count >= MAX_TASK_LEASES]
+        if stale:
+            logging.error('Dropping %d confirmation emails after %d attempts',
+                          len(stale), MAX_TASK_LEASES)
+            queue.delete_tasks(stale)
+            _count('dropped', len(stale))
+
+        by_recipient = {}
+        for task in tasks:
+            if task.retry_count < MAX_TASK_LEASES:
+                by_recipient.setdefault(task.tag, []).append(task)
+        messages = [(to, _render([json.loads(task.payload) for task in tasks]),
+                     tasks)
+                    for to, tasks in by_recipient.items()]
+
+        start = time.time()
+        done = _sendAll(messages)
+        _count('sendMillis', int((time.time() - start) * 1000))
+        if done:
+            queue.delete_tasks(done)
+        delivered = len(set(task.tag for task in done))
+        sent += delivered
+        _count('sent', delivered)
+        _count('failed', len(messages) - delivered)
+        _count('batches')
+    # more is waiting; continue in the next window
+    _scheduleFlush()
+    return sent
@@ -12,10 +12,25 @@ created by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+import json
+
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
 from conference import ConferenceApi
+from conferencesearch import indexConference
+from conferencesearch import reindexConferences
+from instrumentation import getStats
+from mailer import flushMail
+from mailer import getMetrics
+from models import Session
+from registrations import migrateRegistrations
+from schedule import rebuildSchedule
+from seats import syncSeatsAvailable
+from speakers import indexSessions
+from speakers import reindexSpeakers
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
@@ -27,6 +42,7 @@ class SetAnnouncementHandler(webapp2.RequestHandler):
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
         """Send email confirming Conference creation."""
+        # only drains tasks queued before confirmations went to the mailer
         mail.send_mail(
             'noreply@%s.appspotmail.com' % (
                 app_identity.get_application_id()),     # from
@@ -37,6 +53,29 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
                 'conferenceInfo')
         )
 
+class FlushMailHandler(webapp2.RequestHandler):
+    def get(self):
+        """Send pending confirmation emails (cron)"""
+        flushMail()
+        self.response.set_status(204)
+
+    def post(self):
+        """Send pending confirmation emails"""
+        flushMail()
+        self.response.set_status(204)
+
+class MailMetricsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return the mailer's throughput counters as JSON"""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(getMetrics()))
+
+class RpcStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return the per-endpoint RPC counters as JSON"""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(getStats()))
+
 class SetFeaturedSpeakerHandler(webapp2.RequestHandler):
     def post(self):
         """Set Featured Speaker in Memcache"""
@@ -45,9 +84,80 @@ class SetFeaturedSpeakerHandler(webapp2.RequestHandler):
         ConferenceApi._cacheFeaturedSpeaker(speaker, conference_key)
         self.response.set_status(204)
 
+class RebuildScheduleHandler(webapp2.RequestHandler):
+    def post(self):
+        """Rebuild a Conference's schedule snapshot in Memcache"""
+        rebuildSchedule(self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+class IndexImportedSessionsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Index a Conference's Sessions by speaker after an import, then
+        recompute the featured speaker"""
+        wsck = self.request.get('websafeConferenceKey')
+        # sessions indexed before are skipped
+        indexSessions(Session.query(ancestor=ndb.Key(urlsafe=wsck)).fetch())
+        ConferenceApi._recomputeFeaturedSpeaker(wsck)
+        self.response.set_status(204)
+
+class UpdateOrganizerDisplayNameHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy an organizer's new displayName onto their Conferences"""
+        cursor = self.request.get('cursor')
+        ConferenceApi._updateOrganizerDisplayName(
+            self.request.get('userId'),
+            Cursor(urlsafe=cursor) if cursor else None)
+        self.response.set_status(204)
+
+class ReindexSpeakersHandler(webapp2.RequestHandler):
+    def post(self):
+        """Add one batch of existing Sessions to the Speaker index"""
+        cursor = self.request.get('cursor')
+        reindexSpeakers(Cursor(urlsafe=cursor) if cursor else None)
+        self.response.set_status(204)
+
+
+class SyncSeatsAvailableHandler(webapp2.RequestHandler):
+    def post(self):
+        """Write the seat counter total back to the Conference"""
+        syncSeatsAvailable(self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+class IndexConferenceHandler(webapp2.RequestHandler):
+    def post(self):
+        """Update a Conference's search document"""
+        indexConference(self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+class ReindexConferencesHandler(webapp2.RequestHandler):
+    def post(self):
+        """Index one batch of existing Conferences for search"""
+        cursor = self.request.get('cursor')
+        reindexConferences(Cursor(urlsafe=cursor) if cursor else None)
+        self.response.set_status(204)
+
+class MigrateRegistrationsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Move one batch of Profile.conferenceKeysToAttend to Registrations"""
+        cursor = self.request.get('cursor')
+        migrateRegistrations(Cursor(urlsafe=cursor) if cursor else None)
+        self.response.set_status(204)
+
 
 app = webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
+    ('/tasks/flush_mail', FlushMailHandler),
+    ('/crons/flush_mail', FlushMailHandler),
+    ('/admin/mail_metrics', MailMetricsHandler),
+    ('/admin/rpc_stats', RpcStatsHandler),
     ('/tasks/set_featured_speaker', SetFeaturedSpeakerHandler),
+    ('/tasks/rebuild_schedule', RebuildScheduleHandler),
+    ('/tasks/index_imported_sessions', IndexImportedSessionsHandler),
+    ('/tasks/update_organizer_display_name', UpdateOrganizerDisplayNameHandler),
+    ('/tasks/sync_seats_available', SyncSeatsAvailableHandler),
+    ('/tasks/reindex_speakers', ReindexSpeakersHandler),
+    ('/tasks/migrate_registrations', MigrateRegistrationsHandler),
+    ('/tasks/index_conference', IndexConferenceHandler),
+    ('/tasks/reindex_conferences', ReindexConferencesHandler),
 ], debug=True)
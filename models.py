@@ -26,8 +26,24 @@ class Profile(ndb.Model):
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
-    conferenceKeysToAttend = ndb.StringProperty(repeated=True)
-    sessionWishlist = ndb.StringProperty(repeated=True)
+    conferenceKeysToAttend = ndb.StringProperty(repeated=True) # legacy, see Registration
+    sessionWishlist = ndb.StringProperty(repeated=True) # legacy, see WishlistEntry
+
+class Registration(ndb.Model):
+    """Registration -- a Profile's seat at a Conference; child of the Profile,
+    keyed by the websafe Conference key"""
+    conference = ndb.KeyProperty(kind='Conference', required=True)
+    created    = ndb.DateTimeProperty(auto_now_add=True)
+
+class WishlistEntry(ndb.Model):
+    """WishlistEntry -- a Session on a Profile's wishlist; child of the
+    Profile, keyed by the websafe Session key, with a copy of the session's
+    time slot for conflict checks"""
+    session     = ndb.KeyProperty(kind='Session', required=True, indexed=False)
+    conference  = ndb.KeyProperty(kind='Conference', required=True)
+    date        = ndb.DateProperty()
+    startMinute = ndb.IntegerProperty() # minutes after midnight
+    endMinute   = ndb.IntegerProperty(indexed=False)
 
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
@@ -42,6 +58,17 @@ class ProfileForm(messages.Message):
     conferenceKeysToAttend = messages.StringField(4, repeated=True)
     sessionWishlist = messages.StringField(5, repeated=True)
 
+class ProfileForms(messages.Message):
+    """ProfileForms -- multiple Profile outbound form message"""
+    items = messages.MessageField(ProfileForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+class FeaturedSpeakerForm(messages.Message):
+    """FeaturedSpeakerForm -- featured speaker of a conference outbound message"""
+    websafeConferenceKey = messages.StringField(1)
+    speaker = messages.StringField(2)
+    sessionNames = messages.StringField(3, repeated=True)
+
 class StringMessage(messages.Message):
     """StringMessage-- outbound (single) string message"""
     data = messages.StringField(1, required=True)
@@ -55,13 +82,25 @@ class Conference(ndb.Model):
     name            = ndb.StringProperty(required=True)
     description     = ndb.StringProperty()
     organizerUserId = ndb.StringProperty()
+    organizerDisplayName = ndb.StringProperty(indexed=False) # copy of Profile.displayName
     topics          = ndb.StringProperty(repeated=True)
     city            = ndb.StringProperty()
     startDate       = ndb.DateProperty()
     month           = ndb.IntegerProperty() # TODO: do we need for indexing like Java?
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
-    seatsAvailable  = ndb.IntegerProperty()
+    seatsAvailable  = ndb.IntegerProperty() # synced from the seat counter shards
+    seatShards      = ndb.IntegerProperty(indexed=False)
+
+class NearlySoldOut(ndb.Model):
+    """NearlySoldOut -- sorted [name, websafeConferenceKey] pairs of the
+    conferences in the announcement"""
+    entries = ndb.JsonProperty(default=[])
+
+class SeatCounterShard(ndb.Model):
+    """SeatCounterShard -- one shard of a Conference's available seat counter"""
+    conference = ndb.KeyProperty(kind='Conference', required=True)
+    seats      = ndb.IntegerProperty(default=0, indexed=False)
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -77,10 +116,56 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10) #DateTimeField()
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    seatShards      = messages.IntegerField(13, variant=messages.Variant.INT32)
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    queryPlan = messages.StringField(3) # set when the query asked for debug
+
+class ConferenceSearchForm(messages.Message):
+    """ConferenceSearchForm -- full-text conference search inbound form message"""
+    query = messages.StringField(1)
+    city = messages.StringField(2)
+    topic = messages.StringField(3)
+    month = messages.IntegerField(4, variant=messages.Variant.INT32)
+    pageSize = messages.IntegerField(5, variant=messages.Variant.INT32)
+    pageToken = messages.StringField(6)
+    view = messages.EnumField('ListView', 7)
+
+class FacetValueForm(messages.Message):
+    """FacetValueForm -- one facet value and its number of matches"""
+    label = messages.StringField(1)
+    count = messages.IntegerField(2)
+
+class FacetForm(messages.Message):
+    """FacetForm -- the most frequent values of one facet"""
+    name = messages.StringField(1)
+    values = messages.MessageField(FacetValueForm, 2, repeated=True)
+
+class ConferenceSearchForms(messages.Message):
+    """ConferenceSearchForms -- ranked conference search results"""
+    items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    totalMatches = messages.IntegerField(3)
+    facets = messages.MessageField(FacetForm, 4, repeated=True)
+
+class BatchRegistrationForm(messages.Message):
+    """BatchRegistrationForm -- register every user for every conference"""
+    userIds = messages.StringField(1, repeated=True)
+    websafeConferenceKeys = messages.StringField(2, repeated=True)
+
+class BatchRegistrationResultForm(messages.Message):
+    """BatchRegistrationResultForm -- outcome for one user and conference"""
+    websafeConferenceKey = messages.StringField(1)
+    userId = messages.StringField(2)
+    registered = messages.BooleanField(3)
+    error = messages.StringField(4)
+
+class BatchRegistrationResultForms(messages.Message):
+    """BatchRegistrationResultForms -- outcomes of a batch registration"""
+    items = messages.MessageField(BatchRegistrationResultForm, 1, repeated=True)
 
 class TeeShirtSize(messages.Enum):
     """TeeShirtSize -- t-shirt size enumeration value"""
@@ -109,6 +194,15 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2, variant=messages.Variant.INT32)
+    pageToken = messages.StringField(3)
+    view = messages.EnumField('ListView', 4)
+    debug = messages.BooleanField(5)
+
+class ListView(messages.Enum):
+    """ListView -- how much of each listed entity to return"""
+    FULL = 1
+    SUMMARY = 2
 
 class Session(ndb.Model):
     """Session -- stores a session"""
@@ -120,6 +214,13 @@ class Session(ndb.Model):
     date = ndb.DateProperty()
     startTime = ndb.TimeProperty()
 
+class Speaker(ndb.Model):
+    """Speaker -- sessions given by one speaker; keyed by normalized name"""
+    name = ndb.StringProperty(indexed=False)
+    sessionKeys = ndb.KeyProperty(kind='Session', repeated=True, indexed=False)
+    conferenceCounts = ndb.JsonProperty() # websafe Conference key -> sessions
+    conferenceKeys = ndb.KeyProperty(kind='Conference', repeated=True)
+
 class SessionForm(messages.Message):
     """SessionForm -- session form message"""
     name = messages.StringField(1, required=True)
@@ -138,6 +239,24 @@ class SessionMiniForm(messages.Message):
 class SessionForms(messages.Message):
     """SessionForms -- multiple Session outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+class WishlistResultForm(messages.Message):
+    """WishlistResultForm -- outcome of a wishlist change, with the wishlist
+    sessions that overlap the added one"""
+    data = messages.BooleanField(1)
+    conflictingSessionKeys = messages.StringField(2, repeated=True)
+
+class SessionImportForm(messages.Message):
+    """SessionImportForm -- sessions to import, as forms and/or CSV text"""
+    sessions = messages.MessageField(SessionForm, 1, repeated=True)
+    csv = messages.StringField(2) # header row of SessionForm field names
+
+class SessionImportResultForm(messages.Message):
+    """SessionImportResultForm -- outcome of a session import"""
+    imported = messages.IntegerField(1)
+    errors = messages.StringField(2, repeated=True)
+    websafeSessionKeys = messages.StringField(3, repeated=True)
 
 class SessionTimeQueryForm(messages.Message):
     """SessionForm -- for querying sessions within a certain time range"""
@@ -148,6 +267,9 @@ class SessionTypeTimeForm(messages.Message):
     """SessionTypeTimeForm -- for excluding type and time"""
     excludedSessionType = messages.EnumField('SessionType', 1)
     latestTime = messages.StringField(2)
+    pageSize = messages.IntegerField(3, variant=messages.Variant.INT32)
+    pageToken = messages.StringField(4)
+    view = messages.EnumField('ListView', 5)
 
 class SessionType(messages.Enum):
     """SessionType -- different kinds of session types"""
@@ -155,9 +277,3 @@ class SessionType(messages.Enum):
     WORKSHOP = 2
     NETWORKING = 3
     LECTURE = 4
-
-class SessionForms(messages.Message):
-    """SessionForms -- multiple Session outbound form message"""
-    items = messages.MessageField(SessionForm, 1, repeated=True)
-
-
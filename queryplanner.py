@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+"""queryplanner.py
+
+Planner for queryConferences filters.
+
+Of the submitted filters, the most selective set that one of the
+composite indexes in index.yaml can serve is sent to the datastore; the
+rest (NE, inequalities on a second field, further topics, anything
+without an index) are checked in memory while the datastore results are
+streamed. Each page scans at most MAX_SCAN entities, so a filter matching
+little never turns into a full scan within one request: the page is cut
+short and its token continues the scan.
+
+"""
+
+import collections
+import itertools
+import operator
+
+from google.appengine.ext import ndb
+
+from models import Conference
+
+MAX_SCAN = 500                  # entities read per page for residual filters
+
+# Conference composite indexes from index.yaml, each ending in the name
+# sort order; keep in step with index.yaml
+CONFERENCE_INDEXES = (
+    ('city', 'maxAttendees', 'month', 'name'),
+    ('city', 'maxAttendees', 'month', 'topics', 'name'),
+    ('city', 'maxAttendees', 'name'),
+    ('city', 'month', 'name'),
+    ('city', 'month', 'topics', 'name'),
+    ('city', 'name'),
+    ('city', 'topics', 'name'),
+    ('maxAttendees', 'month', 'name'),
+    ('maxAttendees', 'month', 'topics', 'name'),
+    ('maxAttendees', 'name'),
+    ('maxAttendees', 'topics', 'name'),
+    ('month', 'name'),
+    ('month', 'topics', 'name'),
+    ('topics', 'name'),
+)
+
+# rough selectivity of an equality filter on each field
+SELECTIVITY = {
+    'city': 4,
+    'topics': 3,
+    'month': 2,
+    'maxAttendees': 1,
+}
+
+RANGE_OPERATORS = ('<', '<=', '>', '>=')
+
+_COMPARE = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+Plan = collections.namedtuple('Plan', 'pushed residual inequality')
+
+
+def _served(equalities, inequality, indexes):
+    """Whether an index serves equality filters on the fields equalities
+    plus an inequality on field inequality, ordered by it and then name."""
+    if not equalities and not inequality:
+        # built-in index on name
+        return True
+    for index in indexes:
+        prefix = index[:-1]
+        if inequality:
+            if prefix[-1] != inequality:
+                continue
+            prefix = prefix[:-1]
+        if len(prefix) == len(equalities) and set(prefix) == equalities:
+            return True
+    return False
+
+
+def _score(equalities, inequality):
+    return (sum(SELECTIVITY.get(field, 1) for field in equalities) +
+            (1 if inequality else 0))
+
+
+def plan(filters, indexes=CONFERENCE_INDEXES):
+    """Split filters (dicts with field, operator and value) into those sent
+    to the datastore and those applied in memory.
+
+    Only one equality filter per field is pushed down; NE filters always
+    stay in memory since the datastore runs them as two inequalities.
+    """
+    first_equality = collections.OrderedDict()
+    ranges = collections.OrderedDict()
+    for filtr in filters:
+        if filtr['operator'] == '=':
+            first_equality.setdefault(filtr['field'], filtr)
+        elif filtr['operator'] in RANGE_OPERATORS:
+            ranges.setdefault(filtr['field'], []).append(filtr)
+
+    best, best_score = (frozenset(), None), -1
+    fields = list(first_equality)
+    for size in range(len(fields), -1, -1):
+        for subset in itertools.combinations(fields, size):
+            equalities = frozenset(subset)
+            for inequality in [None] + list(ranges):
+                if inequality in equalities:
+                    continue
+                score = _score(equalities, inequality)
+                if score > best_score and _served(equalities, inequality, indexes):
+                    best, best_score = (equalities, inequality), score
+
+    equalities, inequality = best
+    pushed = [first_equality[field] for field in fields if field in equalities]
+    if inequality:
+        pushed.extend(ranges[inequality])
+    residual = [filtr for filtr in filters
+                if not any(filtr is p for p in pushed)]
+    return Plan(pushed, residual, inequality)
+
+
+def buildQuery(query_plan):
+    """Return the datastore query for the pushed down filters."""
+    q = Conference.query()
+    for filtr in query_plan.pushed:
+        q = q.filter(ndb.query.FilterNode(filtr['field'], filtr['operator'],
+                                          filtr['value']))
+    if query_plan.inequality:
+        q = q.order(ndb.GenericProperty(query_plan.inequality))
+    return q.order(Conference.name)
+
+
+def _matches(entity, filtr):
+    # datastore semantics: a repeated property matches if any value does,
+    # a missing one never does
+    values = getattr(entity, filtr['field'], None)
+    if not isinstance(values, list):
+        values = [values]
+    compare = _COMPARE[filtr['operator']]
+    return any(value is not None and compare(value, filtr['value'])
+               for value in values)
+
+
+def matches(query_plan, entity):
+    """Whether entity passes the residual filters."""
+    return all(_matches(entity, filtr) for filtr in query_plan.residual)
+
+
+def fetchPage(query_plan, page_size, start_cursor=None, keys_only=False,
+              max_scan=MAX_SCAN):
+    """Return (results, next cursor or None) for one page of the plan.
+
+    With residual filters the query is streamed and filtered until the
+    page is full or max_scan entities were read, whichever comes first.
+    """
+    q = buildQuery(query_plan)
+    if not query_plan.residual:
+        results, cursor, more = q.fetch_page(
+            page_size, start_cursor=start_cursor, keys_only=keys_only)
+        return results, (cursor if more else None)
+
+    results = []
+    scanned = 0
+    it = q.iter(start_cursor=start_cursor, produce_cursors=True,
+                batch_size=min(max_scan, page_size * 2))
+    for entity in it:
+        scanned += 1
+        if matches(query_plan, entity):
+            results.append(entity.key if keys_only else entity)
+        if len(results) >= page_size or scanned >= max_scan:
+            if it.probably_has_next():
+                return results, it.cursor_after()
+            break
+    return results, None
+
+
+def describe(query_plan):
+    """Return a readable summary of the plan for debug output."""
+    def fmt(filters):
+        return ', '.join('%s %s %r' % (f['field'], f['operator'], f['value'])
+                         for f in filters) or 'none'
+    order = ([query_plan.inequality] if query_plan.inequality else []) + ['name']
+    description = 'datastore: %s; order: %s; in memory: %s' % (
+        fmt(query_plan.pushed), ', '.join(order), fmt(query_plan.residual))
+    if query_plan.residual:
+        description += ' (at most %d scanned per page)' % MAX_SCAN
+    return description
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+"""registrations.py
+
+Helpers around the Registration kind, which replaced the
+Profile.conferenceKeysToAttend list: one small entity per user and
+conference, stored under the Profile and keyed by the websafe Conference
+key, so "is this user registered" is a single keyed get.
+
+"""
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Profile
+from models import Registration
+
+MIGRATION_BATCH_SIZE = 100
+
+
+def registrationKey(p_key, wsck):
+    """Return the Registration key of Profile p_key for conference wsck."""
+    return ndb.Key(Registration, wsck, parent=p_key)
+
+
+def getConferenceKeysToAttend(p_key):
+    """Return the Conference keys the Profile is registered for."""
+    return [ndb.Key(urlsafe=reg_key.id()) for reg_key in
+            Registration.query(ancestor=p_key).fetch(keys_only=True)]
+
+
+def getConferenceKeysToAttendMulti(p_keys):
+    """Return the Conference keys for each Profile key, querying all of
+    them concurrently."""
+    futures = [Registration.query(ancestor=p_key).fetch_async(keys_only=True)
+               for p_key in p_keys]
+    return [[ndb.Key(urlsafe=reg_key.id()) for reg_key in future.get_result()]
+            for future in futures]
+
+
+def getAttendeeKeys(conf_key, page_size, cursor=None):
+    """Return one page of the Profile keys registered for the Conference,
+    the next page's cursor and whether there are more."""
+    reg_keys, next_cursor, more = Registration.query(
+        Registration.conference == conf_key).fetch_page(
+            page_size, start_cursor=cursor, keys_only=True)
+    return [reg_key.parent() for reg_key in reg_keys], next_cursor, more
+
+
+@ndb.transactional()
+def migrateProfile(p_key):
+    """Move a Profile's legacy conferenceKeysToAttend into Registrations.
+
+    Registrations are children of the Profile, so this is a single entity
+    group transaction; seat counts already include these registrations.
+    """
+    prof = p_key.get()
+    if not prof or not prof.conferenceKeysToAttend:
+        return prof
+    ndb.put_multi([Registration(key=registrationKey(p_key, wsck),
+                                conference=ndb.Key(urlsafe=wsck))
+                   for wsck in set(prof.conferenceKeysToAttend)])
+    prof.conferenceKeysToAttend = []
+    prof.put()
+    return prof
+
+
+def migrateRegistrations(cursor=None):
+    """Migrate one batch of Profiles, chaining a task for the next batch."""
+    p_keys, next_cursor, more = Profile.query().fetch_page(
+        MIGRATION_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+    for prof in ndb.get_multi(p_keys):
+        if prof and prof.conferenceKeysToAttend:
+            migrateProfile(prof.key)
+    if more and next_cursor:
+        taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                      url='/tasks/migrate_registrations')
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+"""schedule.py
+
+Per-conference schedule snapshots.
+
+A snapshot holds every Session of a Conference, sorted by date and
+startTime and already flattened into SessionForm field values, plus the
+row positions of each session type. Snapshots live in memcache; they are
+rebuilt by /tasks/rebuild_schedule whenever sessions are written, and on
+demand when a reader finds none. They are stored pickled; one too big
+for a memcache item is not cached, and readers build it from the query
+every time.
+
+"""
+
+import cPickle as pickle
+import logging
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import Session
+from utils import addTaskAsync
+
+# snapshots used to be stored unpickled under "CONFERENCE_SCHEDULE:%s"
+MEMCACHE_SCHEDULE_KEY = "CONFERENCE_SCHEDULE2:%s"
+SCHEDULE_TTL = 3600             # seconds
+# memcache rejects bigger items; leaves room for the key and flags
+MAX_SCHEDULE_BYTES = memcache.MAX_VALUE_SIZE - 1024
+
+
+def _sessionRow(session):
+    """Flatten a Session into SessionForm field values."""
+    return {
+        'websafeSessionKey': session.key.urlsafe(),
+        'name': session.name,
+        'highlights': session.highlights,
+        'speaker': session.speaker,
+        'duration': session.duration,
+        'typeOfSession': session.typeOfSession,
+        # same string forms _copySessionToForm produces
+        'date': str(session.date),
+        'startTime': str(session.startTime),
+    }
+
+
+def _buildSchedule(sessions):
+    rows = sorted((_sessionRow(session) for session in sessions),
+                  key=lambda row: (row['date'], row['startTime'], row['name']))
+    types = {}
+    for i, row in enumerate(rows):
+        types.setdefault(row['typeOfSession'], []).append(i)
+    return {'rows': rows, 'types': types}
+
+
+def _encodeSchedule(wsck, schedule):
+    """Return the pickled snapshot, or None if it is too big to cache."""
+    data = pickle.dumps(schedule, pickle.HIGHEST_PROTOCOL)
+    if len(data) > MAX_SCHEDULE_BYTES:
+        logging.warning('Schedule of %s is %d bytes, not cached',
+                        wsck, len(data))
+        return None
+    return data
+
+
+def getSchedule(conference_key):
+    """Return the schedule snapshot of one conference."""
+    return getSchedules([conference_key])[0]
+
+
+def getSchedules(conference_keys):
+    """Return the schedule snapshots of conference_keys, in order.
+
+    Missing snapshots are built from ancestor queries that are all issued
+    before any of them is waited on.
+    """
+    cached = memcache.get_multi([key.urlsafe() for key in conference_keys],
+                                key_prefix=MEMCACHE_SCHEDULE_KEY % '')
+    futures = dict((key.urlsafe(), Session.query(ancestor=key).fetch_async())
+                   for key in conference_keys if key.urlsafe() not in cached)
+    schedules = dict((wsck, pickle.loads(data))
+                     for wsck, data in cached.iteritems())
+    fill = {}
+    for wsck, future in futures.iteritems():
+        schedules[wsck] = _buildSchedule(future.get_result())
+        data = _encodeSchedule(wsck, schedules[wsck])
+        if data is not None:
+            fill[wsck] = data
+    if fill:
+        memcache.set_multi(fill, time=SCHEDULE_TTL,
+                           key_prefix=MEMCACHE_SCHEDULE_KEY % '')
+    return [schedules[key.urlsafe()] for key in conference_keys]
+
+
+def rebuildSchedule(wsck):
+    """Rebuild and store the snapshot of conference wsck."""
+    sessions = Session.query(ancestor=ndb.Key(urlsafe=wsck)).fetch()
+    data = _encodeSchedule(wsck, _buildSchedule(sessions))
+    if data is None:
+        # a stale snapshot must not outlive one that can't be stored
+        memcache.delete(MEMCACHE_SCHEDULE_KEY % wsck)
+    else:
+        memcache.set(MEMCACHE_SCHEDULE_KEY % wsck, data, time=SCHEDULE_TTL)
+
+
+def scheduleChanged(wsck):
+    """Drop the snapshot of conference wsck and queue its rebuild."""
+    scheduleChangedAsync(wsck).get_result()
+
+
+@ndb.tasklet
+def scheduleChangedAsync(wsck):
+    """Async scheduleChanged(); the cache delete and the enqueue overlap."""
+    yield (ndb.get_context().memcache_delete(MEMCACHE_SCHEDULE_KEY % wsck),
+           addTaskAsync('/tasks/rebuild_schedule',
+                        params={'websafeConferenceKey': wsck}))
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+"""seats.py
+
+Sharded seat counter for Conference registration.
+
+Every Conference owns N SeatCounterShard root entities, each holding a
+slice of the conference's free seats. A registration only has to lock one
+shard, so concurrent registrations for the same conference spread over N
+entity groups instead of queueing up on the Conference entity. The sum of
+all shards is the number of seats available; it is cached in memcache and
+periodically written back to Conference.seatsAvailable so that queries on
+that property keep working.
+
+"""
+
+import random
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import SeatCounterShard
+
+import entitycache
+
+DEFAULT_SEAT_SHARDS = 5
+MAX_SEAT_SHARDS = 20            # stay well below the 25 entity group xg limit
+MEMCACHE_SEATS_KEY = "SEATS_AVAILABLE:%s"
+SEATS_CACHE_TTL = 60            # seconds
+SYNC_WINDOW = 10                # seconds between Conference.seatsAvailable syncs
+
+
+def _shardCount(conf):
+    return conf.seatShards or DEFAULT_SEAT_SHARDS
+
+
+def _shardKeys(conf):
+    wsck = conf.key.urlsafe()
+    return [ndb.Key(SeatCounterShard, '%s|%d' % (wsck, i))
+            for i in range(_shardCount(conf))]
+
+
+def _splitSeats(seats, n):
+    """Split seats into n shard values that differ by at most one."""
+    base, extra = divmod(max(seats, 0), n)
+    return [base + (1 if i < extra else 0) for i in range(n)]
+
+
+def createShards(conf):
+    """Create the counter shards of a new Conference from seatsAvailable."""
+    return createShardsAsync(conf).get_result()
+
+
+@ndb.tasklet
+def createShardsAsync(conf):
+    """Async createShards(); the shard puts and the cache write overlap."""
+    shards = [SeatCounterShard(key=key, conference=conf.key, seats=seats)
+              for key, seats in zip(_shardKeys(conf),
+                                    _splitSeats(conf.seatsAvailable or 0,
+                                                _shardCount(conf)))]
+    yield (ndb.put_multi_async(shards),
+           ndb.get_context().memcache_set(MEMCACHE_SEATS_KEY % conf.key.urlsafe(),
+                                          conf.seatsAvailable or 0,
+                                          time=SEATS_CACHE_TTL))
+    raise ndb.Return(shards)
+
+
+def _getShards(conf):
+    """Return the shards of conf, creating them for conferences that
+    predate the seat counter."""
+    shards = ndb.get_multi(_shardKeys(conf))
+    if all(shards):
+        return shards
+
+    @ndb.transactional(xg=True)
+    def _init():
+        existing = ndb.get_multi(_shardKeys(conf))
+        if all(existing):
+            return existing
+        # legacy conference: seed shards from the Conference entity itself
+        fresh = conf.key.get()
+        shards = [shard or SeatCounterShard(key=key, conference=conf.key,
+                                            seats=seats)
+                  for shard, key, seats in zip(existing, _shardKeys(conf),
+                      _splitSeats(fresh.seatsAvailable or 0, _shardCount(conf)))]
+        ndb.put_multi([s for s, e in zip(shards, existing) if not e])
+        return shards
+
+    return _init()
+
+
+def getSeatsAvailable(conf):
+    """Return the number of seats available for conf."""
+    return getSeatsAvailableMulti([conf])[conf.key.urlsafe()]
+
+
+def getSeatsAvailableMulti(confs):
+    """Return dict websafeConferenceKey -> seats available for confs,
+    reading the cached aggregate and summing shards only on a miss."""
+    confs = [conf for conf in confs if conf]
+    cached = memcache.get_multi([conf.key.urlsafe() for conf in confs],
+                                key_prefix=MEMCACHE_SEATS_KEY % '')
+    missing = [conf for conf in confs if conf.key.urlsafe() not in cached]
+    if missing:
+        keys = [_shardKeys(conf) for conf in missing]
+        shards = ndb.get_multi([key for ks in keys for key in ks])
+        fill = {}
+        pos = 0
+        for conf, ks in zip(missing, keys):
+            conf_shards = shards[pos:pos + len(ks)]
+            pos += len(ks)
+            if all(conf_shards):
+                fill[conf.key.urlsafe()] = sum(s.seats for s in conf_shards)
+            else:
+                # shards not created yet; the entity is still authoritative
+                cached[conf.key.urlsafe()] = conf.seatsAvailable or 0
+        # add, not set: a value stored meanwhile is kept in step by
+        # incr/decr and is newer than these shard reads
+        memcache.add_multi(fill, time=SEATS_CACHE_TTL,
+                           key_prefix=MEMCACHE_SEATS_KEY % '')
+        cached.update(fill)
+    return cached
+
+
+def _changeSeats(conf, delta, work):
+    """Apply delta (+1/-1) to one shard of conf and run work() in the same
+    xg transaction. work() returns True to apply the change; it may also
+    raise to abort. Returns (applied, shard_found)."""
+    shards = _getShards(conf)
+    if delta < 0:
+        candidates = [s.key for s in shards if s.seats >= -delta]
+    else:
+        candidates = [s.key for s in shards]
+    random.shuffle(candidates)
+
+    @ndb.transactional(xg=True)
+    def _txn(shard_key):
+        shard = shard_key.get()
+        if shard.seats + delta < 0:
+            # another registration emptied this shard since we looked
+            return None
+        if not work():
+            return False
+        shard.seats += delta
+        shard.put()
+        return True
+
+    for shard_key in candidates:
+        applied = _txn(shard_key)
+        if applied is None:
+            continue
+        if applied:
+            _afterChange(conf, delta)
+        return applied, True
+    return False, False
+
+
+def takeSeat(conf, work):
+    """Take one seat of conf and run work() atomically with it.
+
+    Returns False without running work() to completion when the conference
+    is sold out; no shard is ever allowed to drop below zero, so the
+    conference can never be oversold.
+    """
+    applied, found = _changeSeats(conf, -1, work)
+    return found and applied
+
+
+def releaseSeat(conf, work):
+    """Give one seat of conf back if work() returns True (atomically)."""
+    applied, _ = _changeSeats(conf, 1, work)
+    return applied
+
+
+def reserveSeats(conf, n):
+    """Take n seats of conf at once, spread over as many shards as needed,
+    in one xg transaction. Returns False, taking nothing, when fewer than
+    n seats are free."""
+    if n <= 0:
+        return True
+    _getShards(conf)
+
+    @ndb.transactional(xg=True)
+    def _txn():
+        shards = ndb.get_multi(_shardKeys(conf))
+        if sum(s.seats for s in shards) < n:
+            return False
+        remaining = n
+        changed = []
+        for shard in sorted(shards, key=lambda s: -s.seats):
+            take = min(shard.seats, remaining)
+            if take:
+                shard.seats -= take
+                remaining -= take
+                changed.append(shard)
+            if not remaining:
+                break
+        ndb.put_multi(changed)
+        return True
+
+    if not _txn():
+        return False
+    _afterChange(conf, -n)
+    return True
+
+
+@ndb.transactional(xg=True)
+def _adjustShards(shard_keys, delta):
+    shards = ndb.get_multi(shard_keys)
+    if delta >= 0:
+        for shard, extra in zip(shards, _splitSeats(delta, len(shards))):
+            shard.seats += extra
+        applied = delta
+    else:
+        # remove seats from the fullest shards first; taken seats stay taken
+        remaining = -delta
+        for shard in sorted(shards, key=lambda s: -s.seats):
+            take = min(shard.seats, remaining)
+            shard.seats -= take
+            remaining -= take
+        applied = delta + remaining
+    ndb.put_multi(shards)
+    return applied
+
+
+def adjustSeats(conf, delta):
+    """Add (or remove, for negative delta) free seats, e.g. when
+    maxAttendees changes. Returns the delta actually applied."""
+    if not delta:
+        return 0
+    _getShards(conf)
+    applied = _adjustShards(_shardKeys(conf), delta)
+    memcache.delete(MEMCACHE_SEATS_KEY % conf.key.urlsafe())
+    _enqueueSync(conf)
+    return applied
+
+
+def _afterChange(conf, delta):
+    """Keep the cached aggregate in step and schedule a Conference sync."""
+    key = MEMCACHE_SEATS_KEY % conf.key.urlsafe()
+    # a missing key is simply recomputed from the shards on next read
+    if delta < 0:
+        memcache.decr(key, -delta)
+    else:
+        memcache.incr(key, delta)
+    _enqueueSync(conf)
+
+
+def _enqueueSync(conf):
+    """Enqueue at most one seatsAvailable sync per conference per window."""
+    wsck = conf.key.urlsafe()
+    try:
+        taskqueue.add(
+            name='sync-seats-%s-%d' % (wsck, int(time.time() / SYNC_WINDOW)),
+            params={'websafeConferenceKey': wsck},
+            url='/tasks/sync_seats_available',
+            countdown=SYNC_WINDOW,
+        )
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def syncSeatsAvailable(wsck):
+    """Write the shard total back to Conference.seatsAvailable."""
+    conf = ndb.Key(urlsafe=wsck).get()
+    if not conf:
+        return
+    total = sum(s.seats for s in _getShards(conf))
+
+    @ndb.transactional()
+    def _txn():
+        fresh = conf.key.get()
+        if fresh.seatsAvailable != total:
+            fresh.seatsAvailable = total
+            fresh.put()
+
+    _txn()
+    entitycache.invalidate(conf.key)
+    memcache.add(MEMCACHE_SEATS_KEY % wsck, total, time=SEATS_CACHE_TTL)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+"""speakers.py
+
+Speaker index maintained as sessions are created.
+
+Each Speaker entity is keyed by the normalized speaker name and holds the
+keys of that speaker's sessions plus a session count per conference, so
+looking up a speaker's sessions is one keyed get plus a get_multi and
+"does this speaker have two sessions here" is a dictionary lookup.
+
+"""
+
+import collections
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Session
+from models import Speaker
+
+REINDEX_BATCH_SIZE = 200
+
+
+def normalizeSpeaker(name):
+    """Return the lookup form of a speaker name: case and runs of
+    whitespace don't matter."""
+    return ' '.join((name or '').split()).lower()
+
+
+def speakerKey(name):
+    """Return the Speaker key for name, or None for an empty name."""
+    normalized = normalizeSpeaker(name)
+    return ndb.Key(Speaker, normalized) if normalized else None
+
+
+def getSpeaker(name):
+    """Return the Speaker entity for name, or None."""
+    key = speakerKey(name)
+    return key.get() if key else None
+
+
+@ndb.transactional_tasklet()
+def _addToSpeakerAsync(key, name, session_keys):
+    speaker = (yield key.get_async()) or Speaker(key=key, name=name)
+    known = set(speaker.sessionKeys)
+    added = [s_key for s_key in session_keys if s_key not in known]
+    if not added and speaker.conferenceKeys:
+        raise ndb.Return(speaker)
+    speaker.sessionKeys.extend(added)
+    counts = speaker.conferenceCounts or {}
+    for s_key in added:
+        wsck = s_key.parent().urlsafe()
+        counts[wsck] = counts.get(wsck, 0) + 1
+    speaker.conferenceCounts = counts
+    # indexed, so a conference's speakers can be queried
+    speaker.conferenceKeys = [ndb.Key(urlsafe=wsck) for wsck in sorted(counts)]
+    yield speaker.put_async()
+    raise ndb.Return(speaker)
+
+
+def indexSessions(sessions):
+    """Add sessions to their speakers' index entries, one transaction per
+    speaker; sessions already indexed are skipped, so this is safe to
+    repeat. Returns the updated Speaker entities."""
+    return indexSessionsAsync(sessions).get_result()
+
+
+@ndb.tasklet
+def indexSessionsAsync(sessions):
+    """Async indexSessions(); the per-speaker transactions run concurrently."""
+    by_speaker = collections.OrderedDict()
+    for session in sessions:
+        key = speakerKey(session.speaker)
+        if key:
+            by_speaker.setdefault(key, (session.speaker.strip(), []))[1] \
+                .append(session.key)
+    speakers = yield [_addToSpeakerAsync(key, name, session_keys)
+                      for key, (name, session_keys) in by_speaker.iteritems()]
+    raise ndb.Return(speakers)
+
+
+def reindexSpeakers(cursor=None):
+    """Index one batch of existing Sessions, chaining a task for the next."""
+    sessions, next_cursor, more = Session.query().fetch_page(
+        REINDEX_BATCH_SIZE, start_cursor=cursor)
+    indexSessions(sessions)
+    if more and next_cursor:
+        taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                      url='/tasks/reindex_speakers')
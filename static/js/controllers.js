@@ -441,11 +441,15 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
             }
         }
         $scope.loading = true;
-        gapi.client.conference.queryConferences(sendFilters).
+        $scope.conferences = [];
+        // the API returns one page at a time; follow nextPageToken to the end
+        var queryPage = function (pageToken) {
+            sendFilters.pageToken = pageToken;
+            gapi.client.conference.queryConferences(sendFilters).
             execute(function (resp) {
                 $scope.$apply(function () {
-                    $scope.loading = false;
                     if (resp.error) {
+                        $scope.loading = false;
                         // The request has failed.
                         var errorMessage = resp.error.message || '';
                         $scope.messages = 'Failed to query conferences : ' + errorMessage;
@@ -454,18 +458,24 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                     } else {
                         // The request has succeeded.
                         $scope.submitted = false;
-                        $scope.messages = 'Query succeeded : ' + JSON.stringify(sendFilters);
-                        $scope.alertStatus = 'success';
-                        $log.info($scope.messages);
-
-                        $scope.conferences = [];
                         angular.forEach(resp.items, function (conference) {
                             $scope.conferences.push(conference);
                         });
+                        if (resp.nextPageToken) {
+                            queryPage(resp.nextPageToken);
+                            return;
+                        }
+                        $scope.loading = false;
+                        delete sendFilters.pageToken;
+                        $scope.messages = 'Query succeeded : ' + JSON.stringify(sendFilters);
+                        $scope.alertStatus = 'success';
+                        $log.info($scope.messages);
                     }
                     $scope.submitted = true;
                 });
             });
+        };
+        queryPage();
     }
 
     /**
@@ -473,11 +483,14 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.getConferencesCreated = function () {
         $scope.loading = true;
-        gapi.client.conference.getConferencesCreated().
+        $scope.conferences = [];
+        // the API returns one page at a time; follow nextPageToken to the end
+        var queryPage = function (pageToken) {
+            gapi.client.conference.getConferencesCreated({pageToken: pageToken}).
             execute(function (resp) {
                 $scope.$apply(function () {
-                    $scope.loading = false;
                     if (resp.error) {
+                        $scope.loading = false;
                         // The request has failed.
                         var errorMessage = resp.error.message || '';
                         $scope.messages = 'Failed to query the conferences created : ' + errorMessage;
@@ -491,18 +504,23 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                     } else {
                         // The request has succeeded.
                         $scope.submitted = false;
-                        $scope.messages = 'Query succeeded : Conferences you have created';
-                        $scope.alertStatus = 'success';
-                        $log.info($scope.messages);
-
-                        $scope.conferences = [];
                         angular.forEach(resp.items, function (conference) {
                             $scope.conferences.push(conference);
                         });
+                        if (resp.nextPageToken) {
+                            queryPage(resp.nextPageToken);
+                            return;
+                        }
+                        $scope.loading = false;
+                        $scope.messages = 'Query succeeded : Conferences you have created';
+                        $scope.alertStatus = 'success';
+                        $log.info($scope.messages);
                     }
                     $scope.submitted = true;
                 });
             });
+        };
+        queryPage();
     };
 
     /**
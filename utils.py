@@ -3,9 +3,21 @@ import os
 import time
 import uuid
 
+from google.appengine.api import taskqueue
 from google.appengine.api import urlfetch
+from google.appengine.ext import ndb
 from models import Profile
 
+
+@ndb.tasklet
+def addTaskAsync(url, params=None, queue_name='default', **kwargs):
+    """Enqueue a push task without blocking; a Future, so it can be
+    yielded together with datastore and memcache calls."""
+    task = yield taskqueue.Queue(queue_name).add_async(
+        taskqueue.Task(url=url, params=params, **kwargs))
+    raise ndb.Return(task)
+
+
 def getUserId(user, id_type="email"):
     if id_type == "email":
         return user.email()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+"""wishlist.py
+
+Session wishlists stored as WishlistEntry entities.
+
+Each entry is a child of the Profile keyed by the websafe Session key, so
+adding or removing a session is a single keyed write, and it carries the
+session's conference, date and start/end minute. Entries are indexed by
+(date, startMinute) under their Profile, so the sessions that overlap a
+new one are found with one query over that day's earlier starts instead
+of loading every wishlisted session.
+
+"""
+
+from google.appengine.ext import ndb
+from google.net.proto.ProtocolBuffer import ProtocolBufferDecodeError
+
+from models import Session
+from models import WishlistEntry
+
+
+def entryKey(p_key, wssk):
+    """Return the WishlistEntry key of Profile p_key for session wssk."""
+    return ndb.Key(WishlistEntry, wssk, parent=p_key)
+
+
+def _minutes(t):
+    return t.hour * 60 + t.minute if t else None
+
+
+def _newEntry(p_key, session):
+    start = _minutes(session.startTime)
+    return WishlistEntry(
+        key=entryKey(p_key, session.key.urlsafe()),
+        session=session.key,
+        conference=session.key.parent(),
+        date=session.date,
+        startMinute=start,
+        endMinute=start + (session.duration or 0) if start is not None else None)
+
+
+def _conflicts(entry):
+    """Return the keys of the other entries whose time slot overlaps entry."""
+    if entry.date is None or entry.startMinute is None:
+        return []
+    # entries that start before this one ends; of those, the ones that end
+    # after it starts overlap
+    earlier = WishlistEntry.query(
+        WishlistEntry.date == entry.date,
+        WishlistEntry.startMinute < max(entry.endMinute, entry.startMinute + 1),
+        ancestor=entry.key.parent())
+    return [other.session for other in earlier
+            if other.key != entry.key and other.endMinute > entry.startMinute]
+
+
+@ndb.transactional()
+def _add(entry):
+    if entry.key.get():
+        return None
+    conflicts = _conflicts(entry)
+    entry.put()
+    return conflicts
+
+
+def addSession(p_key, session):
+    """Add session to the wishlist of Profile p_key. Returns the keys of
+    wishlisted sessions overlapping it, or None if it was already there."""
+    return _add(_newEntry(p_key, session))
+
+
+@ndb.transactional()
+def removeSession(p_key, wssk):
+    """Remove session wssk from the wishlist; returns whether it was there."""
+    key = entryKey(p_key, wssk)
+    if not key.get():
+        return False
+    key.delete()
+    return True
+
+
+def wishlistQuery(p_key, conference_key=None):
+    """Return the query over a wishlist, optionally of one conference, in
+    schedule order."""
+    q = WishlistEntry.query(ancestor=p_key)
+    if conference_key:
+        q = q.filter(WishlistEntry.conference == conference_key)
+    return q.order(WishlistEntry.date, WishlistEntry.startMinute)
+
+
+def getSessionKeysMulti(p_keys):
+    """Return the wishlisted Session keys for each Profile key, querying all
+    of them concurrently."""
+    futures = [WishlistEntry.query(ancestor=p_key).fetch_async(keys_only=True)
+               for p_key in p_keys]
+    return [[ndb.Key(urlsafe=entry_key.id()) for entry_key in future.get_result()]
+            for future in futures]
+
+
+def migrateWishlist(profile):
+    """Move a Profile's legacy sessionWishlist into WishlistEntry entities,
+    skipping sessions that no longer exist. Returns the updated Profile."""
+    p_key = profile.key
+    session_keys = []
+    for wssk in set(profile.sessionWishlist):
+        try:
+            session_keys.append(ndb.Key(urlsafe=wssk))
+        except (TypeError, ProtocolBufferDecodeError):
+            continue
+    sessions = [session for session in ndb.get_multi(session_keys)
+                if isinstance(session, Session)]
+
+    @ndb.transactional()
+    def _migrate():
+        prof = p_key.get()
+        if not prof.sessionWishlist:
+            return prof
+        ndb.put_multi([_newEntry(p_key, session) for session in sessions])
+        prof.sessionWishlist = []
+        prof.put()
+        return prof
+
+    return _migrate()